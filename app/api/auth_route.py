@@ -1,20 +1,38 @@
 from fastapi import APIRouter, HTTPException, Depends, Header, Request, Query
-from pydantic import BaseModel, EmailStr, validator
+from fastapi.concurrency import run_in_threadpool
+from pydantic import AfterValidator, BaseModel, field_validator, model_validator
 from typing import Optional
+from typing_extensions import Annotated
+from emval import EmailValidator
 import logging
-import traceback
 
+from app.api.route import invalidate_user_profile
 # Use the REST API implementation instead of the Admin SDK
 from app.services.firebase_auth_rest import (
+    CurrentUser,
     signup_with_email_password,
     signin_with_email_password,
-    get_user_info,
+    aget_user_info,
     update_profile
 )
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# User-facing messages for the error codes returned by the auth service
+REGISTER_ERRORS = {
+    "EMAIL_EXISTS": "This email is already registered. Please use a different email or try logging in.",
+    "INVALID_EMAIL": "The email address is not valid. Please check and try again.",
+    "WEAK_PASSWORD": "The password is too weak. Please use a stronger password.",
+}
+
+LOGIN_ERRORS = {
+    "EMAIL_NOT_FOUND": "Invalid email or password. Please try again.",
+    "INVALID_PASSWORD": "Invalid email or password. Please try again.",
+    "USER_DISABLED": "This account has been disabled. Please contact support.",
+    "TOO_MANY_ATTEMPTS_TRY_LATER": "Too many failed login attempts. Please try again later.",
+}
+
 # Create router
 router = APIRouter(
     prefix="/auth",
@@ -22,66 +40,87 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Rust-backed email validation; deliverability (DNS) checks stay off, matching EmailStr
+_email_validator = EmailValidator(deliverable_address=False)
+
+def _validate_email(value: str) -> str:
+    """
+    Validate an email address and return its normalized form
+    """
+    try:
+        return _email_validator.validate_email(value).normalized
+    except SyntaxError as e:
+        raise ValueError(str(e))
+
+FastEmail = Annotated[str, AfterValidator(_validate_email)]
+
 class UserRegisterRequest(BaseModel):
     name: str
-    email: EmailStr
+    email: FastEmail
     password: str
     confirm_password: str
     
-    @validator('confirm_password')
-    def passwords_match(cls, v, values, **kwargs):
-        if 'password' in values and v != values['password']:
+    @model_validator(mode='after')
+    def passwords_match(self):
+        if self.password != self.confirm_password:
             raise ValueError('Passwords do not match')
-        return v
+        return self
     
-    @validator('name')
+    @field_validator('name')
+    @classmethod
     def name_not_empty(cls, v):
-        if not v or not v.strip():
+        v = v.strip()
+        if not v:
             raise ValueError('Name cannot be empty')
-        return v.strip()
+        return v
     
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def password_strength(cls, v):
         if len(v) < 6:
             raise ValueError('Password must be at least 6 characters')
         return v
 
 class UserLoginRequest(BaseModel):
-    email: EmailStr
+    email: FastEmail
     password: str
 
 class UserUpdateRequest(BaseModel):
     display_name: Optional[str] = None
     photo_url: Optional[str] = None
 
-async def get_current_user(request: Request, token: str = Query(None)):
+def _extract_auth_token(authorization: Optional[str], token: Optional[str]) -> Optional[str]:
     """
-    Dependency to get the current user from the authorization header or token query parameter
+    Pick the auth token from the Authorization header (with or without a Bearer
+    prefix), falling back to the token query parameter
     """
-    # Check for Authorization header first
-    authorization = request.headers.get("Authorization")
-    
     if authorization:
         auth_token = authorization.strip()
-    elif token:
-        # Fallback to token query parameter
-        auth_token = token
-    else:
+        scheme, _, credentials = auth_token.partition(" ")
+        if credentials and scheme.lower() == "bearer":
+            auth_token = credentials.strip()
+        return auth_token or None
+    return token or None
+
+async def get_current_user(request: Request, token: str = Query(None)) -> CurrentUser:
+    """
+    Dependency to get the current user from the authorization header or token query parameter
+    """
+    auth_token = _extract_auth_token(request.headers.get("Authorization"), token)
+    if not auth_token:
         raise HTTPException(
             status_code=401,
             detail="Missing authentication token. Please include an Authorization header or token query parameter."
         )
     
-    # Verify the token and get user info
-    user = get_user_info(auth_token)
+    # Verify the token and get user info (served from cache when possible)
+    user = await aget_user_info(auth_token)
     if user is None:
         raise HTTPException(
             status_code=401,
             detail="Invalid or expired token"
         )
     
-    # Add token to user data for later use
-    user["token"] = auth_token
     return user
 
 @router.post("/register")
@@ -90,12 +129,14 @@ async def register(request: UserRegisterRequest):
     Register a new user with name, email, and password
     """
     try:
-        logger.info(f"Attempting to register user with email: {request.email}")
+        logger.info("Attempting to register user with email: %s", request.email)
         
         # We've already validated that passwords match in the model
         
         # Register the user with email and password
-        success, result = signup_with_email_password(
+        # Sign-up does blocking Firestore calls and password hashing, so run it in the threadpool
+        success, result = await run_in_threadpool(
+            signup_with_email_password,
             email=request.email,
             password=request.password,
             display_name=request.name
@@ -103,25 +144,17 @@ async def register(request: UserRegisterRequest):
         
         if not success:
             error_detail = result.get("error", "Registration failed")
-            logger.error(f"Registration failed: {error_detail}")
+            logger.error("Registration failed: %s", error_detail)
             
             # Add user-friendly error messages
-            error_message = "Registration failed"
-            if "EMAIL_EXISTS" in error_detail:
-                error_message = "This email is already registered. Please use a different email or try logging in."
-            elif "INVALID_EMAIL" in error_detail:
-                error_message = "The email address is not valid. Please check and try again."
-            elif "WEAK_PASSWORD" in error_detail:
-                error_message = "The password is too weak. Please use a stronger password."
-            else:
-                error_message = f"Registration failed: {error_detail}"
+            error_message = REGISTER_ERRORS.get(result.get("code"), f"Registration failed: {error_detail}")
                 
             raise HTTPException(
                 status_code=400,
                 detail=error_message
             )
         
-        logger.info(f"User registered successfully: {request.email}")
+        logger.info("User registered successfully: %s", request.email)
         
         # Add success message to the result
         result["message"] = "Registration successful! You can now log in."
@@ -131,8 +164,7 @@ async def register(request: UserRegisterRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during registration: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Unexpected error during registration: %s", e)
         if "CONFIGURATION_NOT_FOUND" in str(e):
             raise HTTPException(
                 status_code=500,
@@ -149,33 +181,27 @@ async def login(request: UserLoginRequest):
     Login with email and password
     """
     try:
-        success, result = signin_with_email_password(
-            request.email, 
+        # Sign-in does blocking Firestore calls and password hashing, so run it in the threadpool
+        success, result = await run_in_threadpool(
+            signin_with_email_password,
+            request.email,
             request.password,
             is_email=True
         )
         
         if not success:
             error_detail = result.get("error", "Login failed")
-            logger.error(f"Login failed: {error_detail}")
+            logger.error("Login failed: %s", error_detail)
             
             # Add user-friendly error messages
-            error_message = "Login failed"
-            if "EMAIL_NOT_FOUND" in error_detail or "INVALID_PASSWORD" in error_detail:
-                error_message = "Invalid email or password. Please try again."
-            elif "USER_DISABLED" in error_detail:
-                error_message = "This account has been disabled. Please contact support."
-            elif "TOO_MANY_ATTEMPTS_TRY_LATER" in error_detail:
-                error_message = "Too many failed login attempts. Please try again later."
-            else:
-                error_message = f"Login failed: {error_detail}"
+            error_message = LOGIN_ERRORS.get(result.get("code"), f"Login failed: {error_detail}")
                 
             raise HTTPException(
                 status_code=401,
                 detail=error_message
             )
         
-        logger.info(f"User logged in successfully: {request.email}")
+        logger.info("User logged in successfully: %s", request.email)
         
         # Add success message to the result
         result["message"] = "Login successful!"
@@ -185,8 +211,7 @@ async def login(request: UserLoginRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during login: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Unexpected error during login: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Login failed: {str(e)}"
@@ -194,7 +219,7 @@ async def login(request: UserLoginRequest):
 
 @router.get("/me", summary="Get current user info")
 async def get_current_user_info(
-    current_user = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Get current user information.
@@ -207,7 +232,7 @@ async def get_current_user_info(
 @router.put("/me", summary="Update user profile")
 async def update_current_user(
     request: UserUpdateRequest,
-    current_user = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """
     Update current user profile.
@@ -215,8 +240,9 @@ async def update_current_user(
     - **Authorization**: Required. Provide your authentication token in the header
     - **token**: Alternative. You can also provide the token as a query parameter
     """
-    success, result = update_profile(
-        current_user["token"],
+    success, result = await run_in_threadpool(
+        update_profile,
+        current_user.token,
         display_name=request.display_name,
         photo_url=request.photo_url
     )
@@ -227,6 +253,9 @@ async def update_current_user(
             detail=result.get("error", "Update failed")
         )
     
+    # /user-profile would otherwise keep serving the old name and photo
+    invalidate_user_profile(current_user.uid)
+    
     # Add success message to the result
     result["message"] = "Profile updated successfully!"
     result["success"] = True
@@ -1,18 +1,35 @@
 from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-import json
+from cachetools import TTLCache
+import orjson
 import logging
-import traceback
+import threading
 from datetime import datetime
 from typing import List, Optional
+from google.api_core.exceptions import NotFound
 from google.cloud import firestore
 from app.models.model_loader import get_model, get_tokenizer
-from app.services.generation_service import generate_response
-from app.services.firebase_initiator import initialize_firebase
+from app.services.generation_service import agenerate_response
+from app.services.firebase_initiator import initialize_firebase_async
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Short-lived per-user cache for /user-profile reads, cleared when the user saves a quiz
+# or updates their profile
+_PROFILE_CACHE_TTL_SECONDS = 30
+_profile_cache = TTLCache(maxsize=10000, ttl=_PROFILE_CACHE_TTL_SECONDS)
+_profile_cache_lock = threading.Lock()
+
+def invalidate_user_profile(user_id: str):
+    """
+    Drop the cached /user-profile response for a user after their profile changes
+    """
+    with _profile_cache_lock:
+        _profile_cache.pop(user_id, None)
+
 # Create router
 router = APIRouter(
     prefix="/api",
@@ -46,9 +63,9 @@ async def verify_user_exists(user_id: str = Query(..., description="The user ID
     Verify that the user exists in the database
     """
     try:
-        db = initialize_firebase()
+        db = initialize_firebase_async()
         user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
+        user_doc = await user_ref.get()
         
         if not user_doc.exists:
             raise HTTPException(
@@ -64,14 +81,14 @@ async def verify_user_exists(user_id: str = Query(..., description="The user ID
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error verifying user: {str(e)}")
+        logger.error("Error verifying user: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error verifying user: {str(e)}"
         )
 
-@router.post("/ask")
-def ask(request: AskRequest):
+@router.post("/ask", response_class=ORJSONResponse)
+async def ask(request: AskRequest):
     """
     Generate a quiz with the specified number of questions about the given topic.
     
@@ -81,15 +98,17 @@ def ask(request: AskRequest):
     Returns a JSON quiz with multiple-choice questions.
     """
     try:
-        # Create a standardized instruction
-        instruction = f"Create {request.number_of_questions} multiple-choice questions about {request.topic}"
+        # Create a standardized instruction; collapsing whitespace lets equivalent topics share cached prompts
+        topic = " ".join(request.topic.split())
+        instruction = f"Create {request.number_of_questions} multiple-choice questions about {topic}"
         
-        # Generate quiz
-        response = generate_response(instruction)
-        return response
+        # Generate quiz; concurrent requests are batched into one model call off the event loop
+        response = await agenerate_response(instruction)
+        # Returning the response directly skips FastAPI's jsonable_encoder pass over the quiz;
+        # it is already plain JSON data, so orjson serializes it in one step
+        return ORJSONResponse(response)
     except Exception as e:
-        logger.error(f"Error in /ask endpoint: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error in /ask endpoint: %s", e)
         if "CONFIGURATION_NOT_FOUND" in str(e):
             raise HTTPException(
                 status_code=500,
@@ -97,27 +116,60 @@ def ask(request: AskRequest):
             )
         raise
 
+# Starting stats for users who have not saved a quiz yet
+_DEFAULT_QUIZ_STATS = {
+    "totalQuizzes": 0,
+    "totalCorrect": 0,
+    "totalQuestions": 0,
+    "averageScore": 0
+}
+
+def _merge_quiz_stats(user_data, quiz_result: QuizResultRequest):
+    """
+    Fold a quiz result into the user's existing quiz statistics
+    """
+    stats = user_data.get("quizStats")
+    if stats is None:
+        stats = _DEFAULT_QUIZ_STATS.copy()
+    
+    # Update stats (quizStats is only ever written with all keys present)
+    stats["totalQuizzes"] += 1
+    stats["totalCorrect"] += quiz_result.score
+    stats["totalQuestions"] += quiz_result.totalQuestions
+    
+    # Calculate new average
+    if stats["totalQuestions"] > 0:
+        stats["averageScore"] = (stats["totalCorrect"] / stats["totalQuestions"]) * 100
+    
+    return stats
+
+@firestore.async_transactional
+async def _save_quiz_result_transaction(transaction, user_ref, quiz_ref, result_data, quiz_result):
+    """
+    Save a quiz result and update the user's stats atomically.
+    
+    Firestore may retry this function if the user document changes underneath it.
+    """
+    user_doc = await user_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"User with ID {user_ref.id} not found"
+        )
+    
+    stats = _merge_quiz_stats(user_doc.to_dict(), quiz_result)
+    transaction.set(quiz_ref, result_data)
+    transaction.update(user_ref, {"quizStats": stats})
+    return stats
+
 @router.post("/save-quiz")
-def submit_quiz_result(quiz_result: QuizResultRequest, user_id: str = Query(..., description="User ID for authentication")):
+async def submit_quiz_result(quiz_result: QuizResultRequest, user_id: str = Query(..., description="User ID for authentication")):
     """
     Save quiz result to Firebase.
     
     Requires user_id query parameter for authentication.
     """
     try:
-        # Initialize Firebase
-        db = initialize_firebase()
-        
-        # Verify user exists
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
-        
-        if not user_doc.exists:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"User with ID {user_id} not found"
-            )
-        
         # Verify the user ID matches the one in the quiz result
         if user_id != quiz_result.userId:
             raise HTTPException(
@@ -125,37 +177,25 @@ def submit_quiz_result(quiz_result: QuizResultRequest, user_id: str = Query(...,
                 detail="User ID in query parameter does not match userId in quiz result"
             )
         
+        # Initialize Firebase
+        db = initialize_firebase_async()
+        user_ref = db.collection("users").document(user_id)
+        
         # Convert to dictionary and add timestamps
-        result_data = quiz_result.dict()
+        result_data = quiz_result.model_dump()
         result_data["createdAt"] = datetime.now().isoformat()
         
-        # Save to Firestore
+        # Read the user, save the result and update stats in a single commit
         quiz_ref = db.collection("quiz_results").document()
-        quiz_ref.set(result_data)
+        stats = await _save_quiz_result_transaction(
+            db.transaction(), user_ref, quiz_ref, result_data, quiz_result
+        )
         
         # Add the document ID to the response
         result_data["id"] = quiz_ref.id
         
-        # Update user stats without a transaction (simpler approach)
-        user_data = user_doc.to_dict()
-        stats = user_data.get("quizStats", {
-            "totalQuizzes": 0,
-            "totalCorrect": 0,
-            "totalQuestions": 0,
-            "averageScore": 0
-        })
-        
-        # Update stats
-        stats["totalQuizzes"] = stats.get("totalQuizzes", 0) + 1
-        stats["totalCorrect"] = stats.get("totalCorrect", 0) + quiz_result.score
-        stats["totalQuestions"] = stats.get("totalQuestions", 0) + quiz_result.totalQuestions
-        
-        # Calculate new average
-        if stats["totalQuestions"] > 0:
-            stats["averageScore"] = (stats["totalCorrect"] / stats["totalQuestions"]) * 100
-        
-        # Update the document
-        user_ref.update({"quizStats": stats})
+        # The cached profile now has stale quiz stats
+        invalidate_user_profile(user_id)
         
         return {
             "success": True,
@@ -166,55 +206,77 @@ def submit_quiz_result(quiz_result: QuizResultRequest, user_id: str = Query(...,
         
     except HTTPException:
         raise
+    except NotFound:
+        # The user document was deleted between the transaction's read and its commit
+        raise HTTPException(
+            status_code=404, 
+            detail=f"User with ID {user_id} not found"
+        )
     except Exception as e:
-        logger.error(f"Error saving quiz result: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error saving quiz result: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to save quiz result: {str(e)}"
         )
 
 @router.get("/latest-quiz-results")
-def get_quiz_results(user_id: str = Query(..., description="User ID to retrieve quiz results")):
+async def get_quiz_results(user_id: str = Query(..., description="User ID to retrieve quiz results")):
     """
     Get last  quiz results for a user.
     """
     try:
-        db = initialize_firebase()
+        db = initialize_firebase_async()
         quiz_results_ref = db.collection("quiz_results").where("userId", "==", user_id).limit(5).stream()
         
         quiz_results = []
-        for result in quiz_results_ref:
+        async for result in quiz_results_ref:
             quiz_results.append(result.to_dict())
         return {"quizResults": quiz_results}
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error retrieving quiz results: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error retrieving quiz results: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to retrieve quiz results: {str(e)}"
         )
 
+async def _stream_quiz_results(first_result, quiz_results_ref):
+    """
+    Encode quiz results one document at a time as a {"quizResults": [...]} JSON body
+    """
+    yield b'{"quizResults":['
+    if first_result is not None:
+        yield orjson.dumps(first_result.to_dict(), default=jsonable_encoder)
+        async for result in quiz_results_ref:
+            yield b"," + orjson.dumps(result.to_dict(), default=jsonable_encoder)
+    yield b"]}"
+
 @router.get('/all-quiz-results')
-def get_all_quiz_results(user_id: str = Query(..., description="User ID to retrieve quiz results")):
+async def get_all_quiz_results(user_id: str = Query(..., description="User ID to retrieve quiz results")):
     """
     Get all quiz results for a user.
+    
+    Results are streamed as they arrive from Firestore instead of being collected first.
     """
     try:
-        db = initialize_firebase()
+        db = initialize_firebase_async()
         quiz_results_ref = db.collection("quiz_results").where("userId", "==", user_id).stream()
         
-        quiz_results = []
-        for result in quiz_results_ref:
-            quiz_results.append(result.to_dict())
-        return {"quizResults": quiz_results}
+        # Fetch the first document here so query errors still surface as a 500
+        try:
+            first_result = await quiz_results_ref.__anext__()
+        except StopAsyncIteration:
+            first_result = None
+        
+        return StreamingResponse(
+            _stream_quiz_results(first_result, quiz_results_ref),
+            media_type="application/json"
+        )
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error retrieving quiz results: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error retrieving quiz results: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to retrieve quiz results: {str(e)}"
@@ -226,7 +288,12 @@ async def get_user_profile(user_id: str = Query(..., description="User ID to ret
     Get a user's profile including quiz statistics.
     """
     try:
-        user_data = await verify_user_exists(user_id)
+        with _profile_cache_lock:
+            user_data = _profile_cache.get(user_id)
+        if user_data is None:
+            user_data = await verify_user_exists(user_id)
+            with _profile_cache_lock:
+                _profile_cache[user_id] = user_data
         return {
             "success": True,
             "profile": user_data
@@ -234,7 +301,7 @@ async def get_user_profile(user_id: str = Query(..., description="User ID to ret
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error retrieving user profile: {str(e)}")
+        logger.error("Error retrieving user profile: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to retrieve user profile: {str(e)}"
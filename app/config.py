@@ -14,27 +14,78 @@ if not FIREBASE_API_KEY:
     logger.warning("FIREBASE_API_KEY environment variable is not set. Firebase authentication will not work.")
     # Use a placeholder value for development - this won't work in production
     FIREBASE_API_KEY = "FIREBASE_API_KEY_NOT_SET"
+# Firebase Admin SDK service account file
+FIREBASE_CREDENTIALS_PATH = os.environ.get("FIREBASE_CREDENTIALS_PATH", "creds/klyptik.json")
+# Query the users collection for accounts that are missing from the emails index; set to False
+# once backfill_email_index has been run so sign-up and sign-in only do keyed reads
+EMAIL_INDEX_LEGACY_LOOKUP = os.environ.get("EMAIL_INDEX_LEGACY_LOOKUP", "True").lower() in ("true", "1", "t")
 
 # Model Configuration
 MODEL_PATH = os.environ.get("MODEL_PATH", "VannWasHere/qwen3-tuned-response")
+# Inference backend: "transformers" (model.generate with request batching) or "vllm"
+# (continuous batching and paged KV cache; needs the optional vllm package and a GPU)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "transformers").lower()
+# Weight quantization: "none" (fp16), "4bit" (NF4 via bitsandbytes, CUDA only) or
+# "8bit" (bitsandbytes INT8 on CUDA, dynamic INT8 quantization on CPU) or "awq"
+# (MODEL_PATH is a pre-quantized 4-bit AWQ checkpoint, loaded with AutoAWQ on CUDA)
+MODEL_QUANTIZATION = os.environ.get("MODEL_QUANTIZATION", "none").lower()
+# Attention kernel: "sdpa" (PyTorch fused attention), "flash_attention_2" (needs flash-attn) or "eager"
+MODEL_ATTENTION = os.environ.get("MODEL_ATTENTION", "sdpa").lower()
+# Compile the model with torch.compile and a static KV cache at startup (slower startup, faster generation)
+MODEL_COMPILE = os.environ.get("MODEL_COMPILE", "False").lower() in ("true", "1", "t")
+# Optional small model with the same tokenizer used as a speculative-decoding draft
+# (e.g. "Qwen/Qwen2.5-0.5B"); assisted generation runs one request at a time
+DRAFT_MODEL_PATH = os.environ.get("DRAFT_MODEL_PATH", "")
+# Maximum number of tokens generated per quiz, not counting the prompt
+MODEL_MAX_NEW_TOKENS = int(os.environ.get("MODEL_MAX_NEW_TOKENS", 2048))
+
+# Generation batching: concurrent /ask requests arriving within the wait window share one model.generate call
+GENERATION_MAX_BATCH_SIZE = int(os.environ.get("GENERATION_MAX_BATCH_SIZE", 8))
+GENERATION_MAX_WAIT_MS = float(os.environ.get("GENERATION_MAX_WAIT_MS", 20))
+# Number of generated quizzes kept for repeated instructions; 0 disables the cache, so every
+# request samples a fresh quiz
+GENERATION_CACHE_SIZE = int(os.environ.get("GENERATION_CACHE_SIZE", 0))
+# Constrain decoding to the quiz JSON schema with lm-format-enforcer (optional dependency,
+# transformers backend only); malformed output can then only come from hitting the token limit
+GENERATION_CONSTRAINED_JSON = os.environ.get("GENERATION_CONSTRAINED_JSON", "False").lower() in ("true", "1", "t")
 
 # Server Configuration
+# Comma-separated list of origins allowed by CORS; "*" allows any origin
+ALLOWED_ORIGINS = [origin.strip() for origin in os.environ.get("ALLOWED_ORIGINS", "*").split(",") if origin.strip()]
 PORT = int(os.environ.get("PORT", 8000))
 HOST = os.environ.get("HOST", "0.0.0.0")
 DEBUG = os.environ.get("DEBUG", "True").lower() in ("true", "1", "t")
+# Each worker process loads its own copy of the model, so keep this at 1 on a shared GPU
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", 1))
 
 # Function to get configuration as a dictionary
 def get_config():
     return {
         "firebase": {
             "api_key": FIREBASE_API_KEY,
+            "credentials_path": FIREBASE_CREDENTIALS_PATH,
+            "email_index_legacy_lookup": EMAIL_INDEX_LEGACY_LOOKUP,
         },
         "model": {
             "path": MODEL_PATH,
+            "backend": MODEL_BACKEND,
+            "quantization": MODEL_QUANTIZATION,
+            "attention": MODEL_ATTENTION,
+            "compile": MODEL_COMPILE,
+            "draft_path": DRAFT_MODEL_PATH,
+            "max_new_tokens": MODEL_MAX_NEW_TOKENS,
+        },
+        "generation": {
+            "max_batch_size": GENERATION_MAX_BATCH_SIZE,
+            "max_wait_ms": GENERATION_MAX_WAIT_MS,
+            "cache_size": GENERATION_CACHE_SIZE,
+            "constrained_json": GENERATION_CONSTRAINED_JSON,
         },
         "server": {
             "port": PORT,
             "host": HOST,
             "debug": DEBUG,
+            "workers": WORKERS,
+            "allowed_origins": ALLOWED_ORIGINS,
         }
     } 
\ No newline at end of file
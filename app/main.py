@@ -1,19 +1,21 @@
 from fastapi import FastAPI
 import logging
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from app.models.model_loader import load_model
+from app.services.generation_service import generation_batcher
 from app.api.route import router as api_router
 from app.api.auth_route import router as auth_router
-from app.config import FIREBASE_API_KEY
+from app.config import FIREBASE_API_KEY, ALLOWED_ORIGINS
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
 
 # Log the API key (masked for security)
 if FIREBASE_API_KEY:
-    logger.info(f"Firebase API Key loaded: {FIREBASE_API_KEY[:5]}...")
+    logger.info("Firebase API Key loaded: %s...", FIREBASE_API_KEY[:5])
 else:
     logger.error("Firebase API Key not found!")
 
@@ -21,15 +23,17 @@ else:
 app = FastAPI(
     title="Klyptik API",
     description="API for generating quiz questions using AI",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"], 
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"], 
     allow_headers=["*"],
+    max_age=86400,  # Let browsers cache preflight responses for a day
 )
 
 # Include routers
@@ -42,6 +46,14 @@ async def startup_event():
     Load the model on startup
     """
     load_model()
+    generation_batcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """
+    Stop the generation batcher
+    """
+    await generation_batcher.stop()
 
 @app.get("/")
 def read_root():
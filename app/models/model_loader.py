@@ -1,45 +1,224 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 from fastapi import HTTPException
+import importlib.util
 import logging
 
+from app.config import (
+    DRAFT_MODEL_PATH,
+    GENERATION_CONSTRAINED_JSON,
+    GENERATION_MAX_BATCH_SIZE,
+    MODEL_ATTENTION,
+    MODEL_BACKEND,
+    MODEL_COMPILE,
+    MODEL_MAX_NEW_TOKENS,
+    MODEL_PATH,
+    MODEL_QUANTIZATION
+)
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Initialize model and tokenizer as None
 _model = None
 _tokenizer = None
+# Speculative-decoding draft model, loaded only when DRAFT_MODEL_PATH is set
+_draft_model = None
+# vLLM engine, used instead of the model and tokenizer when MODEL_BACKEND is "vllm"
+_engine = None
+
+# Maximum number of sequences the vLLM engine decodes concurrently
+_VLLM_MAX_NUM_SEQS = 32
+# Prompt tokens reserved in AutoAWQ's fused KV cache on top of MODEL_MAX_NEW_TOKENS
+_AWQ_MAX_PROMPT_TOKENS = 512
+
+def _get_quantization_config(quantization):
+    """
+    Build the bitsandbytes config for the requested quantization mode
+    """
+    if quantization in ("", "none"):
+        return None
+    if quantization == "awq" and not torch.cuda.is_available():
+        # The checkpoint holds packed 4-bit weights that from_pretrained cannot load as fp16
+        raise RuntimeError("MODEL_QUANTIZATION=awq requires a GPU; use 8bit or none on CPU")
+    if not torch.cuda.is_available():
+        # 8-bit on CPU is handled by _quantize_dynamic after loading
+        if quantization != "8bit":
+            logger.warning("Quantization '%s' requires a GPU. Loading the model without quantization.", quantization)
+        return None
+    if quantization == "4bit":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=torch.float16
+        )
+    if quantization == "8bit":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    if quantization == "awq":
+        # AWQ checkpoints are already quantized and loaded by _load_awq_model
+        return None
+    logger.warning("Unknown quantization mode '%s'. Loading the model without quantization.", quantization)
+    return None
+
+def _get_attn_implementation(attention):
+    """
+    Resolve the attention kernel, falling back to SDPA when flash-attn is not usable
+    """
+    if attention == "flash_attention_2":
+        if not torch.cuda.is_available() or importlib.util.find_spec("flash_attn") is None:
+            logger.warning("FlashAttention-2 needs a GPU and the flash-attn package. Using SDPA attention.")
+            return "sdpa"
+        return attention
+    if attention in ("sdpa", "eager"):
+        return attention
+    logger.warning("Unknown attention implementation '%s'. Using SDPA attention.", attention)
+    return "sdpa"
+
+def _uses_cpu_int8(quantization):
+    """
+    Whether the model should be quantized with dynamic INT8 on the CPU
+    """
+    return quantization == "8bit" and not torch.cuda.is_available()
 
-def load_model(model_path="VannWasHere/qwen3-tuned-response"):
+def _uses_awq(quantization):
+    """
+    Whether the model is a pre-quantized AWQ checkpoint to load with AutoAWQ
+    """
+    return quantization == "awq" and torch.cuda.is_available()
+
+def _load_awq_model(model_path):
+    """
+    Load a pre-quantized 4-bit AWQ checkpoint with fused layers; autoawq is an
+    optional dependency, so it is imported only here
+    
+    The fused layers preallocate their KV cache, so it is sized for the largest batch
+    the batcher builds and for the prompt plus MODEL_MAX_NEW_TOKENS.
+    """
+    try:
+        from awq import AutoAWQForCausalLM
+    except ImportError as e:
+        raise RuntimeError("MODEL_QUANTIZATION=awq requires the autoawq package (pip install autoawq)") from e
+    
+    awq_model = AutoAWQForCausalLM.from_quantized(
+        model_path,
+        fuse_layers=True,
+        safetensors=True,
+        batch_size=max(1, GENERATION_MAX_BATCH_SIZE),
+        max_seq_len=_AWQ_MAX_PROMPT_TOKENS + MODEL_MAX_NEW_TOKENS
+    )
+    # The wrapped transformers model is what exposes generate() and the generation config
+    return awq_model.model
+
+def _quantize_dynamic(model):
+    """
+    Quantize the Linear layers of a CPU model to INT8 weights
+    """
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _warm_up(model, tokenizer):
+    """
+    Run one short generation so compilation happens at startup instead of on the first request
+    """
+    logger.info("Warming up model...")
+    input_ids = tokenizer("<|im_start|>user\nHello<|im_end|>", return_tensors="pt").input_ids.to(model.device)
+    with torch.inference_mode():
+        model.generate(input_ids, max_new_tokens=8, pad_token_id=tokenizer.eos_token_id)
+    logger.info("Model warm-up complete")
+
+def _load_vllm_engine(model_path):
+    """
+    Create the vLLM engine; vllm is an optional dependency, so it is imported only here
+    """
+    try:
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+    except ImportError as e:
+        raise RuntimeError("MODEL_BACKEND=vllm requires the vllm package (pip install vllm)") from e
+    
+    engine_args = AsyncEngineArgs(model=model_path, dtype="float16", max_num_seqs=_VLLM_MAX_NUM_SEQS)
+    return AsyncLLMEngine.from_engine_args(engine_args)
+
+def load_model(model_path=MODEL_PATH):
     """
     Load the model and tokenizer
     """
-    global _model, _tokenizer
+    global _model, _tokenizer, _engine, _draft_model
     try:
+        if MODEL_BACKEND == "vllm":
+            logger.info("Loading model with the vLLM backend...")
+            if MODEL_QUANTIZATION not in ("", "none") or MODEL_COMPILE:
+                logger.warning("MODEL_QUANTIZATION and MODEL_COMPILE are ignored by the vLLM backend")
+            _engine = _load_vllm_engine(model_path)
+            logger.info("vLLM engine loaded successfully")
+            return
+        
+        # lm-format-enforcer is imported per batch, so check for it before serving requests
+        if GENERATION_CONSTRAINED_JSON and importlib.util.find_spec("lmformatenforcer") is None:
+            raise RuntimeError("GENERATION_CONSTRAINED_JSON requires the lm-format-enforcer package (pip install lm-format-enforcer)")
+        
         # Check GPU availability
         if torch.cuda.is_available():
-            logger.info(f"GPU is available. Device: {torch.cuda.get_device_name(0)}")
-            logger.info(f"CUDA version: {torch.version.cuda}")
+            logger.info("GPU is available. Device: %s", torch.cuda.get_device_name(0))
+            logger.info("CUDA version: %s", torch.version.cuda)
         else:
             logger.warning("No GPU available. Model will run on CPU.")
         
         logger.info("Loading model and tokenizer...")
-        _model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
+        quantization_config = _get_quantization_config(MODEL_QUANTIZATION)
+        cpu_int8 = _uses_cpu_int8(MODEL_QUANTIZATION)
+        awq = _uses_awq(MODEL_QUANTIZATION)
+        if awq:
+            _model = _load_awq_model(model_path)
+        else:
+            _model = AutoModelForCausalLM.from_pretrained(
+                model_path,
+                # Dynamic INT8 quantization works from float32 weights
+                torch_dtype=torch.float32 if cpu_int8 else torch.float16,
+                device_map="auto",
+                quantization_config=quantization_config,
+                attn_implementation=_get_attn_implementation(MODEL_ATTENTION)
+            )
+        if cpu_int8:
+            _model = _quantize_dynamic(_model)
+        _model.generation_config.use_cache = True
         _tokenizer = AutoTokenizer.from_pretrained(model_path)
+        # Batched prompts are left-padded so generation continues from each prompt's last token
+        _tokenizer.padding_side = "left"
+        if _tokenizer.pad_token is None:
+            _tokenizer.pad_token = _tokenizer.eos_token
+        
+        if quantization_config is not None or cpu_int8 or awq:
+            logger.info("Model weights quantized: %s", MODEL_QUANTIZATION)
+        
+        if DRAFT_MODEL_PATH:
+            logger.info("Loading draft model for speculative decoding: %s", DRAFT_MODEL_PATH)
+            _draft_model = AutoModelForCausalLM.from_pretrained(
+                DRAFT_MODEL_PATH,
+                torch_dtype=torch.float16,
+                device_map="auto"
+            )
+        
+        if MODEL_COMPILE:
+            logger.info("Compiling model with torch.compile...")
+            # A static KV cache keeps tensor shapes fixed between decode steps, so the
+            # CUDA graphs captured by "reduce-overhead" can be replayed instead of re-recorded.
+            # Assisted generation rolls the cache back on rejected tokens, so it keeps the dynamic one.
+            if callable(getattr(_model, "_setup_cache", None)):
+                if _draft_model is None:
+                    _model.generation_config.cache_implementation = "static"
+            else:
+                logger.warning("%s does not support a static KV cache; compiling with the dynamic cache", type(_model).__name__)
+            _model.forward = torch.compile(_model.forward, mode="reduce-overhead", fullgraph=False)
+            _warm_up(_model, _tokenizer)
         
         # Log device placement
         if hasattr(_model, 'device'):
-            logger.info(f"Model loaded on device: {_model.device}")
+            logger.info("Model loaded on device: %s", _model.device)
         else:
             logger.info("Model device placement not explicitly set")
             
         logger.info("Model and tokenizer loaded successfully")
     except Exception as e:
-        logger.error(f"Error loading model: {str(e)}")
+        logger.error("Error loading model: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to load model: {str(e)}"
@@ -57,6 +236,12 @@ def get_model():
         )
     return _model
 
+def get_draft_model():
+    """
+    Get the speculative-decoding draft model, or None if none is configured
+    """
+    return _draft_model
+
 def get_tokenizer():
     """
     Get the loaded tokenizer
@@ -67,4 +252,16 @@ def get_tokenizer():
             status_code=500,
             detail="Tokenizer not loaded. Please check server logs."
         )
-    return _tokenizer 
\ No newline at end of file
+    return _tokenizer 
+
+def get_engine():
+    """
+    Get the loaded vLLM engine
+    """
+    global _engine
+    if _engine is None:
+        raise HTTPException(
+            status_code=500,
+            detail="vLLM engine not loaded. Please check server logs."
+        )
+    return _engine
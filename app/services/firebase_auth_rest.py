@@ -1,17 +1,26 @@
-import requests
-import json
 import logging
-import os
-import traceback
+import secrets
+import threading
 import uuid
 import time
 import hashlib
+import hmac
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, Tuple
 
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import TTLCache
 from firebase_admin import firestore
-from app.services.firebase_firestore import create_user_profile, get_email_by_username
+from app.services.firebase_firestore import (
+    EmailAlreadyExists,
+    create_user_profile,
+    get_email_by_username,
+    get_uid_by_email
+)
 from app.config import FIREBASE_API_KEY
-from app.services.firebase_initiator import initialize_firebase
+from app.services.firebase_initiator import initialize_firebase, initialize_firebase_async
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -20,23 +29,131 @@ logger = logging.getLogger(__name__)
 if not FIREBASE_API_KEY or FIREBASE_API_KEY == "FIREBASE_API_KEY_NOT_SET":
     logger.warning("Firebase API key is not set or has default value. Using direct Firestore authentication instead.")
 
-# Get Firestore client
-db = initialize_firebase()
+# Cache of verified token -> (user info, token expiry), so repeated requests skip the
+# Firestore lookup. Entries are short-lived to bound how long a revoked token stays
+# accepted, and are rejected on read once the token itself has expired.
+_USER_CACHE_TTL_SECONDS = 60
+_user_cache = TTLCache(maxsize=10000, ttl=_USER_CACHE_TTL_SECONDS)
+_user_cache_lock = threading.Lock()
+
+def _token_cache_key(token: str) -> str:
+    """
+    Build the fixed-size cache key for a token
+    
+    The cached CurrentUser still carries the raw token, so this only keeps keys short.
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """
+    Verified user behind an authentication token
+    
+    Frozen so a single instance can be cached and shared between requests.
+    """
+    uid: str
+    token: str
+    email: Optional[str] = None
+    email_verified: bool = False  # We don't implement email verification in this simplified version
+    display_name: Optional[str] = None
+    photo_url: Optional[str] = None
+    username: Optional[str] = None
+
+# Memory-hard password hashing; the parameters are stored in each hash, so they can be raised later
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+
+def hash_password(password: str) -> str:
+    """
+    Hash a password for storage
+    
+    Args:
+        password: Plain-text password
+        
+    Returns:
+        Argon2id hash string
+    """
+    return _password_hasher.hash(password)
+
+def verify_password(password: str, stored_hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    Check a password against a stored hash
+    
+    Accounts created before Argon2 was adopted have unsalted SHA-256 hashes; those are
+    still accepted, and a replacement Argon2 hash is returned so the caller can upgrade them.
+    
+    Args:
+        password: Plain-text password
+        stored_hash: Hash stored for the user
+        
+    Returns:
+        Tuple of (matches, new hash to store or None)
+    """
+    if not stored_hash:
+        return False, None
+    
+    if not stored_hash.startswith("$argon2"):
+        # Legacy SHA-256 hex digest, compared in constant time
+        legacy_hash = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy_hash.encode(), stored_hash.encode()):
+            return False, None
+        return True, hash_password(password)
+    
+    try:
+        _password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False, None
+    
+    if _password_hasher.check_needs_rehash(stored_hash):
+        return True, hash_password(password)
+    return True, None
+
+# How long an issued token stays valid
+_TOKEN_TTL_SECONDS = 3600
+
+def _token_expiry() -> datetime:
+    """
+    Expiry for a newly issued token
+    
+    Stored as a Firestore timestamp so a TTL policy on `tokens.expires_at` can delete
+    expired tokens server-side.
+    """
+    return datetime.now(timezone.utc) + timedelta(seconds=_TOKEN_TTL_SECONDS)
+
+def _is_expired(expires_at) -> bool:
+    """
+    Whether a token expiry has passed; tokens issued before expiries became
+    timestamps store them as Unix seconds
+    """
+    if isinstance(expires_at, datetime):
+        return expires_at <= datetime.now(timezone.utc)
+    return (expires_at or 0) < time.time()
+
+# Profile fields copied into each token document, so verifying a token is a single read
+_TOKEN_USER_FIELDS = ('email', 'display_name', 'photo_url', 'username')
+
+def _token_data(uid: str, expiry: datetime, user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build a token document with the user's profile fields embedded
+    """
+    token_data = {field: user_data.get(field) for field in _TOKEN_USER_FIELDS}
+    token_data['uid'] = uid
+    token_data['expires_at'] = expiry
+    return token_data
 
 def generate_token(user_id: str) -> str:
     """
-    Generate a simple token for authentication
+    Generate an opaque random token for authentication
+    
+    The owner and expiry live in the token document, so the token itself
+    only needs to be unguessable: 256 bits from the OS CSPRNG.
     
     Args:
-        user_id: User's ID
+        user_id: User's ID (unused; kept for call-site compatibility)
         
     Returns:
-        A token string
+        A URL-safe token string
     """
-    timestamp = str(int(time.time()))
-    random_part = str(uuid.uuid4())
-    token_base = f"{user_id}:{timestamp}:{random_part}"
-    return hashlib.sha256(token_base.encode()).hexdigest()
+    return secrets.token_urlsafe(32)
 
 def signup_with_email_password(email: str, password: str, display_name: str = None, username: str = None) -> Tuple[bool, Dict[str, Any]]:
     """
@@ -52,62 +169,59 @@ def signup_with_email_password(email: str, password: str, display_name: str = No
         Tuple of (success, result)
     """
     try:
-        logger.info(f"Creating user with email: {email}")
-        
-        # Check if email already exists
-        users_ref = db.collection('users')
-        email_query = users_ref.where('email', '==', email).limit(1).stream()
+        db = initialize_firebase()
         
-        for _ in email_query:
-            logger.warning(f"Email already exists: {email}")
-            return False, {"error": "EMAIL_EXISTS"}
+        logger.info("Creating user with email: %s", email)
         
         # Generate a user ID
         uid = str(uuid.uuid4())
         
-        # Hash the password (in a real app, use a proper password hashing library)
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Create user profile in Firestore
-        user_profile = create_user_profile(
-            uid=uid,
-            email=email,
-            display_name=display_name,
-            username=username
-        )
-        
-        # Store password hash in a separate collection for security
-        db.collection('user_auth').document(uid).set({
-            'email': email,
-            'password_hash': hashed_password,
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+        # Hash the password
+        hashed_password = hash_password(password)
         
         # Generate a token
         token = generate_token(uid)
-        
-        # Store token in a tokens collection with expiration
-        expiry = int(time.time()) + 3600  # 1 hour from now
-        db.collection('tokens').document(token).set({
-            'uid': uid,
-            'expires_at': expiry
-        })
-        
-        # Include username in the response if available
-        username = user_profile.get('username') if user_profile else None
-        
-        logger.info(f"User created successfully: {uid}")
+        expiry = _token_expiry()
+        
+        # Create user profile in Firestore; the email claim, the password hash (kept in a
+        # separate collection for security) and the token are committed in the same write
+        try:
+            user_profile = create_user_profile(
+                uid=uid,
+                email=email,
+                display_name=display_name,
+                username=username,
+                extra_writes=[
+                    (db.collection('user_auth').document(uid), {
+                        'email': email,
+                        'password_hash': hashed_password,
+                        'created_at': firestore.SERVER_TIMESTAMP
+                    }),
+                    # Store token in a tokens collection with expiration and the final profile fields
+                    (db.collection('tokens').document(token), lambda profile: _token_data(uid, expiry, profile))
+                ]
+            )
+        except EmailAlreadyExists:
+            logger.warning("Email already exists: %s", email)
+            return False, {"error": "EMAIL_EXISTS", "code": "EMAIL_EXISTS"}
+        
+        if not user_profile:
+            return False, {"error": "Failed to create user profile"}
+        
+        # Include username in the response
+        username = user_profile.get('username')
+        
+        logger.info("User created successfully: %s", uid)
         return True, {
             "uid": uid,
             "email": email,
             "display_name": display_name,
             "username": username,
             "token": token,
-            "expires_in": 3600
+            "expires_in": _TOKEN_TTL_SECONDS
         }
     except Exception as e:
-        logger.error(f"Error during signup: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error during signup: %s", e)
         return False, {"error": str(e)}
 
 def signin_with_email_password(email_or_username: str, password: str, is_email: bool = True) -> Tuple[bool, Dict[str, Any]]:
@@ -123,6 +237,8 @@ def signin_with_email_password(email_or_username: str, password: str, is_email:
         Tuple of (success, result)
     """
     try:
+        db = initialize_firebase()
+        
         # If it's a username, we need to find the corresponding email first
         email = email_or_username
         
@@ -130,49 +246,53 @@ def signin_with_email_password(email_or_username: str, password: str, is_email:
             # This is a username, we need to find the corresponding email
             email = get_email_by_username(email_or_username)
             if not email:
-                logger.warning(f"No email found for username: {email_or_username}")
-                return False, {"error": "Invalid username or password"}
+                logger.warning("No email found for username: %s", email_or_username)
+                return False, {"error": "Invalid username or password", "code": "EMAIL_NOT_FOUND"}
         
         # Find user by email
-        users_ref = db.collection('users')
-        query = users_ref.where('email', '==', email).limit(1).stream()
+        uid = get_uid_by_email(email)
+        if not uid:
+            logger.warning("No user found for email: %s", email)
+            return False, {"error": "Invalid email or password", "code": "EMAIL_NOT_FOUND"}
+        
+        # Fetch the profile and the password hash in one BatchGetDocuments call
+        user_ref = db.collection('users').document(uid)
+        auth_ref = db.collection('user_auth').document(uid)
+        snapshots = {doc.reference.path: doc for doc in db.get_all([user_ref, auth_ref])}
+        user_doc = snapshots[user_ref.path]
+        auth_doc = snapshots[auth_ref.path]
         
-        user_data = None
-        for doc in query:
-            user_data = doc.to_dict()
-            user_data['uid'] = doc.id
-            break
-        
-        if not user_data:
-            logger.warning(f"No user found for email: {email}")
-            return False, {"error": "Invalid email or password"}
+        if not user_doc.exists:
+            logger.warning("No user found for email: %s", email)
+            return False, {"error": "Invalid email or password", "code": "EMAIL_NOT_FOUND"}
         
-        # Get the password hash
-        uid = user_data['uid']
-        auth_doc = db.collection('user_auth').document(uid).get()
+        user_data = user_doc.to_dict()
         
         if not auth_doc.exists:
-            logger.warning(f"No auth data found for user: {uid}")
-            return False, {"error": "Invalid email or password"}
+            logger.warning("No auth data found for user: %s", uid)
+            return False, {"error": "Invalid email or password", "code": "EMAIL_NOT_FOUND"}
         
         auth_data = auth_doc.to_dict()
         stored_hash = auth_data.get('password_hash')
         
         # Check password
-        input_hash = hashlib.sha256(password.encode()).hexdigest()
-        if input_hash != stored_hash:
-            logger.warning(f"Invalid password for user: {uid}")
-            return False, {"error": "Invalid email or password"}
+        password_ok, new_hash = verify_password(password, stored_hash)
+        if not password_ok:
+            logger.warning("Invalid password for user: %s", uid)
+            return False, {"error": "Invalid email or password", "code": "INVALID_PASSWORD"}
         
         # Generate a token
         token = generate_token(uid)
         
-        # Store token in a tokens collection with expiration
-        expiry = int(time.time()) + 3600  # 1 hour from now
-        db.collection('tokens').document(token).set({
-            'uid': uid,
-            'expires_at': expiry
-        })
+        # Store token in a tokens collection with expiration, and record the login, in one commit
+        expiry = _token_expiry()
+        batch = db.batch()
+        batch.set(db.collection('tokens').document(token), _token_data(uid, expiry, user_data))
+        batch.update(user_ref, {'last_login': firestore.SERVER_TIMESTAMP})
+        if new_hash:
+            # Upgrade legacy or outdated hashes while we have the plain-text password
+            batch.update(auth_ref, {'password_hash': new_hash})
+        batch.commit()
         
         return True, {
             "uid": uid,
@@ -180,61 +300,214 @@ def signin_with_email_password(email_or_username: str, password: str, is_email:
             "display_name": user_data.get('display_name'),
             "username": user_data.get('username'),
             "token": token,
-            "expires_in": 3600
+            "expires_in": _TOKEN_TTL_SECONDS
         }
     except Exception as e:
-        logger.error(f"Error during signin: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error during signin: %s", e)
         return False, {"error": str(e)}
 
-def get_user_info(token: str) -> Optional[Dict[str, Any]]:
+def get_cached_user_info(token: str) -> Optional[CurrentUser]:
+    """
+    Get user info for a token from the cache only, without touching Firestore
+    
+    Args:
+        token: Authentication token
+        
+    Returns:
+        Cached user info or None if not cached
+    """
+    cache_key = _token_cache_key(token)
+    with _user_cache_lock:
+        entry = _user_cache.get(cache_key)
+        if entry is None:
+            return None
+        user, expires_at = entry
+        # The token may expire before the cache entry does
+        if _is_expired(expires_at):
+            del _user_cache[cache_key]
+            return None
+        return user
+
+def _cache_user_info(user: CurrentUser, expires_at):
+    """
+    Store verified user info under its token, along with the token's expiry
+    """
+    with _user_cache_lock:
+        _user_cache[_token_cache_key(user.token)] = (user, expires_at)
+
+def get_user_info(token: str) -> Optional[CurrentUser]:
     """
     Get user info from token
     
+    Verified tokens are cached for a short time, so repeated calls skip Firestore.
+    
     Args:
         token: Authentication token
         
     Returns:
         User info or None if failed
     """
+    cached_user = get_cached_user_info(token)
+    if cached_user is not None:
+        return cached_user
+    
+    loaded = _load_user_info(token)
+    if loaded is None:
+        return None
+    user, expires_at = loaded
+    _cache_user_info(user, expires_at)
+    return user
+
+def _patch_cached_user_info(token: str, update_data: Dict[str, Any]):
+    """
+    Apply profile changes to the cached user info for a token, if any
+    """
+    cache_key = _token_cache_key(token)
+    with _user_cache_lock:
+        entry = _user_cache.get(cache_key)
+        if entry is not None:
+            user, expires_at = entry
+            _user_cache[cache_key] = (replace(user, **update_data), expires_at)
+
+def _verified_token_data(token: str, token_doc) -> Optional[Dict[str, Any]]:
+    """
+    Return a token document's data, or None if it is missing or expired
+    """
+    if not token_doc.exists:
+        logger.warning("Token not found: %s", token)
+        return None
+    
+    token_data = token_doc.to_dict()
+    
+    # Check if token is expired
+    if _is_expired(token_data.get('expires_at')):
+        logger.warning("Token expired: %s", token)
+        return None
+    
+    return token_data
+
+def _has_embedded_user(token_data: Dict[str, Any]) -> bool:
+    """
+    Whether a token document carries the profile fields (tokens issued before they
+    were embedded only have the UID and expiry)
+    """
+    return all(field in token_data for field in _TOKEN_USER_FIELDS)
+
+def _current_user_from_data(token: str, uid: str, user_data: Dict[str, Any]) -> CurrentUser:
+    """
+    Build the CurrentUser for a token from a token or profile document's data
+    """
+    return CurrentUser(
+        uid=uid,
+        token=token,
+        email=user_data.get('email'),
+        display_name=user_data.get('display_name'),
+        photo_url=user_data.get('photo_url'),
+        username=user_data.get('username')
+    )
+
+def _current_user_from_doc(token: str, uid: str, user_doc) -> Optional[CurrentUser]:
+    """
+    Build the CurrentUser for a token from the user's profile document
+    """
+    if not user_doc.exists:
+        logger.warning("User not found for token: %s", token)
+        return None
+    
+    return _current_user_from_data(token, uid, user_doc.to_dict())
+
+def _load_user_info(token: str) -> Optional[Tuple[CurrentUser, Any]]:
+    """
+    Verify a token against Firestore and load the user it belongs to
+    
+    Returns:
+        Tuple of (user info, token expiry), or None if the token is not valid
+    """
     try:
+        db = initialize_firebase()
+        
         # Get token document
         token_doc = db.collection('tokens').document(token).get()
-        
-        if not token_doc.exists:
-            logger.warning(f"Token not found: {token}")
+        token_data = _verified_token_data(token, token_doc)
+        if token_data is None:
             return None
         
-        token_data = token_doc.to_dict()
-        
-        # Check if token is expired
-        expires_at = token_data.get('expires_at', 0)
-        if expires_at < time.time():
-            logger.warning(f"Token expired: {token}")
-            return None
-        
-        # Get user data
         uid = token_data.get('uid')
-        user_doc = db.collection('users').document(uid).get()
+        if _has_embedded_user(token_data):
+            user = _current_user_from_data(token, uid, token_data)
+        else:
+            # Older tokens: get user data
+            user_doc = db.collection('users').document(uid).get()
+            user = _current_user_from_doc(token, uid, user_doc)
+    except Exception as e:
+        logger.exception("Error getting user info: %s", e)
+        return None
+    
+    if user is None:
+        return None
+    return user, token_data.get('expires_at')
+
+async def aget_user_info(token: str) -> Optional[CurrentUser]:
+    """
+    Get user info from token using the async Firestore client
+    
+    Same as get_user_info (and shares its cache), but awaits Firestore instead of
+    blocking, so it can be called directly from async route handlers.
+    
+    Args:
+        token: Authentication token
         
-        if not user_doc.exists:
-            logger.warning(f"User not found for token: {token}")
-            return None
+    Returns:
+        User info or None if failed
+    """
+    cached_user = get_cached_user_info(token)
+    if cached_user is not None:
+        return cached_user
+    
+    try:
+        db = initialize_firebase_async()
         
-        user_data = user_doc.to_dict()
+        # Get token document
+        token_doc = await db.collection('tokens').document(token).get()
+        token_data = _verified_token_data(token, token_doc)
+        if token_data is None:
+            return None
         
-        return {
-            "uid": uid,
-            "email": user_data.get('email'),
-            "email_verified": False,  # We don't implement email verification in this simplified version
-            "display_name": user_data.get('display_name'),
-            "photo_url": user_data.get('photo_url'),
-            "username": user_data.get('username')
-        }
+        uid = token_data.get('uid')
+        if _has_embedded_user(token_data):
+            user = _current_user_from_data(token, uid, token_data)
+        else:
+            # Older tokens: get user data
+            user_doc = await db.collection('users').document(uid).get()
+            user = _current_user_from_doc(token, uid, user_doc)
     except Exception as e:
-        logger.error(f"Error getting user info: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error getting user info: %s", e)
         return None
+    
+    if user is not None:
+        _cache_user_info(user, token_data.get('expires_at'))
+    return user
+
+def _update_active_tokens(uid: str, update_data: Dict[str, Any]):
+    """
+    Copy profile changes into the user's unexpired token documents and their cached user info
+    """
+    db = initialize_firebase()
+    batch = db.batch()
+    pending = 0
+    for token_doc in db.collection('tokens').where('uid', '==', uid).stream():
+        if _is_expired(token_doc.to_dict().get('expires_at')):
+            continue
+        batch.update(token_doc.reference, update_data)
+        _patch_cached_user_info(token_doc.id, update_data)
+        pending += 1
+        # Firestore batches hold at most 500 writes
+        if pending == 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
 
 def update_profile(token: str, display_name: str = None, photo_url: str = None) -> Tuple[bool, Dict[str, Any]]:
     """
@@ -254,7 +527,7 @@ def update_profile(token: str, display_name: str = None, photo_url: str = None)
         if not user_info:
             return False, {"error": "Invalid or expired token"}
         
-        uid = user_info.get("uid")
+        uid = user_info.uid
         
         # Prepare data to update
         update_data = {}
@@ -263,25 +536,34 @@ def update_profile(token: str, display_name: str = None, photo_url: str = None)
         if photo_url is not None:
             update_data["photo_url"] = photo_url
         
+        # Build the updated user info locally instead of re-reading it
+        updated_user = replace(user_info, **update_data)
+        
         # Update user profile
         from app.services.firebase_firestore import update_user_profile
-        success = update_user_profile(uid, update_data)
+        success = update_user_profile(uid, dict(update_data))
         
         if not success:
             return False, {"error": "Failed to update profile"}
         
-        # Get updated user info
-        updated_user = get_user_info(token)
+        # Tokens embed the profile fields, so patch the ones still in use (and their
+        # cached user info, which keeps its token expiry). The profile is already saved,
+        # so a failure here only leaves those copies stale and is not reported to the caller.
+        if update_data:
+            try:
+                _update_active_tokens(uid, update_data)
+            except Exception as e:
+                logger.exception("Error updating active tokens for user %s: %s", uid, e)
+                _patch_cached_user_info(token, update_data)
         
         return True, {
-            "uid": updated_user.get("uid"),
-            "email": updated_user.get("email"),
-            "display_name": updated_user.get("display_name"),
-            "photo_url": updated_user.get("photo_url"),
-            "username": updated_user.get("username"),
+            "uid": updated_user.uid,
+            "email": updated_user.email,
+            "display_name": updated_user.display_name,
+            "photo_url": updated_user.photo_url,
+            "username": updated_user.username,
             "token": token
         }
     except Exception as e:
-        logger.error(f"Error updating profile: {str(e)}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error updating profile: %s", e)
         return False, {"error": str(e)} 
\ No newline at end of file
@@ -1,23 +1,118 @@
 import firebase_admin
 from firebase_admin import firestore
+import hashlib
 import logging
+import secrets
 from typing import Dict, Any, Optional
 
+from app.config import EMAIL_INDEX_LEGACY_LOOKUP
+from app.services.firebase_initiator import initialize_firebase
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# How many usernames to try before giving up on creating a profile
+_USERNAME_ATTEMPTS = 5
+
+class _UsernameTaken(Exception):
+    """
+    Raised inside the profile transaction when the candidate username is already claimed
+    """
+
+class EmailAlreadyExists(Exception):
+    """
+    Raised by create_user_profile when another account already uses the email
+    """
+
+def email_key(email: str) -> str:
+    """
+    Document ID of an email in the `emails` lookup collection
+    
+    Keyed on the exact (already normalized) address, like the `users` email field, so
+    addresses that differ only in the case of the local part stay separate accounts.
+    """
+    return hashlib.sha256(email.encode()).hexdigest()
+
 def get_firestore_client():
     """
-    Get Firestore client
+    Get the shared Firestore client
+    
+    The client (and its gRPC channel) is created once per process by
+    initialize_firebase and reused by every helper in this module.
     """
     try:
-        db = firestore.client()
+        db = initialize_firebase()
         return db
     except Exception as e:
-        logger.error(f"Error getting Firestore client: {str(e)}")
+        logger.error("Error getting Firestore client: %s", e)
         raise
 
-def create_user_profile(uid: str, email: str, display_name: str = None, username: str = None):
+def _index_legacy_email(db, email: str) -> Optional[str]:
+    """
+    Find an account created before the emails collection existed and index its email
+    
+    Such accounts can only be found by querying users; indexing them on the way means the
+    next lookup is a keyed read and the sign-up uniqueness check covers them.
+    
+    Returns:
+        The account's UID, or None if no user has the email (or the lookup is disabled)
+    """
+    if not EMAIL_INDEX_LEGACY_LOOKUP:
+        return None
+    for user_doc in db.collection('users').where('email', '==', email).limit(1).stream():
+        db.collection('emails').document(email_key(email)).set({
+            'uid': user_doc.id,
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
+        return user_doc.id
+    return None
+
+@firestore.transactional
+def _create_profile_transaction(transaction, db, uid, email, display_name, username, extra_writes):
+    """
+    Claim `username` and the email, and create the user profile atomically
+    """
+    email_ref = db.collection('emails').document(email_key(email))
+    username_ref = db.collection('usernames').document(username)
+    email_snapshot = email_ref.get(transaction=transaction)
+    username_snapshot = username_ref.get(transaction=transaction)
+    if email_snapshot.exists:
+        raise EmailAlreadyExists(email)
+    if username_snapshot.exists:
+        raise _UsernameTaken(username)
+    
+    # Index the email so sign-up and sign-in can resolve it with a single keyed read
+    transaction.set(email_ref, {
+        'uid': uid,
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    
+    # Create a document in the usernames collection to ensure uniqueness
+    transaction.set(username_ref, {
+        'uid': uid,
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+    
+    # Create user profile
+    user_data = {
+        'uid': uid,
+        'email': email,
+        'username': username,
+        'display_name': display_name or username,
+        'created_at': firestore.SERVER_TIMESTAMP,
+        'updated_at': firestore.SERVER_TIMESTAMP
+    }
+    
+    transaction.set(db.collection('users').document(uid), user_data)
+    
+    # Documents the caller wants committed together with the profile; data may be a
+    # function of the profile for documents that depend on the username picked here
+    for doc_ref, doc_data in extra_writes:
+        transaction.set(doc_ref, doc_data(user_data) if callable(doc_data) else doc_data)
+    
+    return user_data
+
+def create_user_profile(uid: str, email: str, display_name: str = None, username: str = None, extra_writes=()):
     """
     Create a user profile in Firestore
     
@@ -26,47 +121,120 @@ def create_user_profile(uid: str, email: str, display_name: str = None, username
         email: User's email
         display_name: User's display name
         username: User's username (optional)
+        extra_writes: (document reference, data) pairs to set in the same commit (optional);
+            data can also be a function that receives the created profile and returns the data
+    
+    Raises:
+        EmailAlreadyExists: If another account already uses the email
     """
     try:
         db = get_firestore_client()
         
+        # The transaction only checks the emails index, so until the backfill has run make
+        # sure a legacy account with this email is indexed (and rejected) before creating a new one
+        if EMAIL_INDEX_LEGACY_LOOKUP and not db.collection('emails').document(email_key(email)).get().exists:
+            if _index_legacy_email(db, email):
+                raise EmailAlreadyExists(email)
+        
         # If username is not provided, generate one from email
-        if not username:
-            username = email.split('@')[0]
+        base_username = username or email.split('@')[0]
         
-        # Check if username already exists
-        username_doc = db.collection('usernames').document(username).get()
-        if username_doc.exists:
-            # Username already exists, append a number to make it unique
-            base_username = username
-            count = 1
-            while db.collection('usernames').document(f"{base_username}{count}").get().exists:
-                count += 1
-            username = f"{base_username}{count}"
-        
-        # Create a document in the usernames collection to ensure uniqueness
-        db.collection('usernames').document(username).set({
-            'uid': uid,
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
+        # Try the base username first, then random suffixes; each attempt is one transaction
+        # that both claims the username and creates the profile, so there is no check/set race
+        candidate = base_username
+        for _ in range(_USERNAME_ATTEMPTS):
+            try:
+                return _create_profile_transaction(
+                    db.transaction(), db, uid, email, display_name, candidate, extra_writes
+                )
+            except _UsernameTaken:
+                candidate = f"{base_username}{secrets.token_hex(3)}"
+        
+        logger.error("Could not find a free username for: %s", base_username)
+        return None
+    except EmailAlreadyExists:
+        raise
+    except Exception as e:
+        logger.error("Error creating user profile: %s", e)
+        return None
+
+def get_uid_by_email(email: str) -> Optional[str]:
+    """
+    Get user's UID by email
+    
+    Args:
+        email: User's email
+        
+    Returns:
+        User's UID or None if not found
+    """
+    try:
+        db = get_firestore_client()
         
-        # Create user profile
-        user_data = {
-            'uid': uid,
-            'email': email,
-            'username': username,
-            'display_name': display_name or username,
-            'created_at': firestore.SERVER_TIMESTAMP,
-            'updated_at': firestore.SERVER_TIMESTAMP
-        }
+        # Keyed lookup in the emails collection
+        email_ref = db.collection('emails').document(email_key(email))
+        email_doc = email_ref.get()
+        if email_doc.exists:
+            return email_doc.to_dict().get('uid')
         
-        db.collection('users').document(uid).set(user_data)
+        # Accounts created before the emails collection existed are only found by query
+        uid = _index_legacy_email(db, email)
+        if uid:
+            return uid
         
-        return user_data
+        logger.warning("Email not found: %s", email)
+        return None
     except Exception as e:
-        logger.error(f"Error creating user profile: {str(e)}")
+        logger.error("Error getting UID by email: %s", e)
         return None
 
+def backfill_email_index() -> int:
+    """
+    Create `emails` lookup documents for existing users that do not have one yet
+    
+    Run once after deploying the emails collection so the sign-up uniqueness check
+    covers accounts created before it existed, then set EMAIL_INDEX_LEGACY_LOOKUP=False.
+    Accounts that share an email with an already indexed account are logged and skipped.
+    
+    Returns:
+        Number of email documents written
+    """
+    db = get_firestore_client()
+    written = 0
+    # Emails indexed by this run, including writes not committed yet
+    claimed = {}
+    batch = db.batch()
+    pending = 0
+    for user_doc in db.collection('users').stream():
+        email = user_doc.to_dict().get('email')
+        if not email:
+            continue
+        email_ref = db.collection('emails').document(email_key(email))
+        indexed_uid = claimed.get(email_ref.id)
+        if indexed_uid is None:
+            email_doc = email_ref.get()
+            indexed_uid = email_doc.to_dict().get('uid') if email_doc.exists else None
+        if indexed_uid is not None:
+            if indexed_uid != user_doc.id:
+                logger.warning("Email %s of user %s is already indexed for user %s", email, user_doc.id, indexed_uid)
+            continue
+        claimed[email_ref.id] = user_doc.id
+        batch.set(email_ref, {
+            'uid': user_doc.id,
+            'created_at': firestore.SERVER_TIMESTAMP
+        })
+        pending += 1
+        written += 1
+        # Firestore batches hold at most 500 writes
+        if pending == 500:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    logger.info("Backfilled %s email documents", written)
+    return written
+
 def get_email_by_username(username: str) -> Optional[str]:
     """
     Get user's email by username
@@ -83,25 +251,25 @@ def get_email_by_username(username: str) -> Optional[str]:
         # First check if username exists
         username_doc = db.collection('usernames').document(username).get()
         if not username_doc.exists:
-            logger.warning(f"Username not found: {username}")
+            logger.warning("Username not found: %s", username)
             return None
         
         # Get user ID from username document
         uid = username_doc.to_dict().get('uid')
         if not uid:
-            logger.warning(f"User ID not found for username: {username}")
+            logger.warning("User ID not found for username: %s", username)
             return None
         
         # Get user document
         user_doc = db.collection('users').document(uid).get()
         if not user_doc.exists:
-            logger.warning(f"User document not found for UID: {uid}")
+            logger.warning("User document not found for UID: %s", uid)
             return None
         
         # Return user's email
         return user_doc.to_dict().get('email')
     except Exception as e:
-        logger.error(f"Error getting email by username: {str(e)}")
+        logger.error("Error getting email by username: %s", e)
         return None
 
 def update_user_profile(uid: str, data: Dict[str, Any]) -> bool:
@@ -126,7 +294,7 @@ def update_user_profile(uid: str, data: Dict[str, Any]) -> bool:
         
         return True
     except Exception as e:
-        logger.error(f"Error updating user profile: {str(e)}")
+        logger.error("Error updating user profile: %s", e)
         return False
 
 def get_user_profile(uid: str) -> Optional[Dict[str, Any]]:
@@ -145,11 +313,11 @@ def get_user_profile(uid: str) -> Optional[Dict[str, Any]]:
         # Get user document
         user_doc = db.collection('users').document(uid).get()
         if not user_doc.exists:
-            logger.warning(f"User document not found for UID: {uid}")
+            logger.warning("User document not found for UID: %s", uid)
             return None
         
         # Return user profile
         return user_doc.to_dict()
     except Exception as e:
-        logger.error(f"Error getting user profile: {str(e)}")
+        logger.error("Error getting user profile: %s", e)
         return None 
\ No newline at end of file
@@ -1,37 +1,73 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials, firestore, firestore_async
+import functools
 import logging
 import os
 
+from app.config import FIREBASE_CREDENTIALS_PATH
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def _initialize_app():
+    """
+    Return the default Firebase app, initializing it if needed
+    """
+    # Reuse the default app if it has already been initialized
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        pass
+    
+    # Check if the credentials file exists
+    creds_path = FIREBASE_CREDENTIALS_PATH
+    if not os.path.exists(creds_path):
+        logger.error("Firebase credentials file not found at %s", creds_path)
+        raise FileNotFoundError(f"Firebase credentials file not found at {creds_path}")
+    
+    # Log the file size to confirm it's not empty
+    file_size = os.path.getsize(creds_path)
+    logger.info("Found Firebase credentials file. Size: %s bytes", file_size)
+    
+    logger.info("Initializing Firebase...")
+    cred = credentials.Certificate(creds_path)
+    app = firebase_admin.initialize_app(cred)
+    logger.info("Firebase initialized successfully")
+    return app
+
 # Initialize Firebase
+@functools.lru_cache(maxsize=1)
 def initialize_firebase():
     """
-    Initialize Firebase
+    Initialize Firebase and return the Firestore client.
+
+    The client is created once per process and reused on every call.
     """
     try:
-        # Check if the credentials file exists
-        creds_path = "creds/klyptik.json"
-        if not os.path.exists(creds_path):
-            logger.error(f"Firebase credentials file not found at {creds_path}")
-            raise FileNotFoundError(f"Firebase credentials file not found at {creds_path}")
-        
-        # Log the file size to confirm it's not empty
-        file_size = os.path.getsize(creds_path)
-        logger.info(f"Found Firebase credentials file. Size: {file_size} bytes")
-        
-        # Initialize Firebase if not already initialized
-        if not firebase_admin._apps:
-            logger.info("Initializing Firebase...")
-            cred = credentials.Certificate(creds_path)
-            firebase_admin.initialize_app(cred)
-            logger.info("Firebase initialized successfully")
+        app = _initialize_app()
         
         # Get Firestore client
-        db = firestore.client()
+        db = firestore.client(app)
+        return db
+    except Exception as e:
+        logger.error("Error initializing Firebase: %s", e)
+        raise
+
+@functools.lru_cache(maxsize=1)
+def initialize_firebase_async():
+    """
+    Initialize Firebase and return the async Firestore client.
+
+    Use this from `async def` route handlers so Firestore calls are awaited
+    on the event loop instead of blocking it. The client is created once per
+    process and reused on every call.
+    """
+    try:
+        app = _initialize_app()
+        
+        # Get async Firestore client
+        db = firestore_async.client(app)
         return db
     except Exception as e:
-        logger.error(f"Error initializing Firebase: {str(e)}")
-        raise
\ No newline at end of file
+        logger.error("Error initializing Firebase: %s", e)
+        raise
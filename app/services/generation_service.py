@@ -1,14 +1,38 @@
-import json
+import asyncio
 import logging
+import orjson
 import re
+import threading
+import uuid
+import weakref
+from cachetools import LRUCache
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
+from pydantic import BaseModel
+from typing import List, Literal, Optional
 import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
 
-from app.models.model_loader import get_model, get_tokenizer
+from app.config import (
+    DRAFT_MODEL_PATH,
+    GENERATION_CACHE_SIZE,
+    GENERATION_CONSTRAINED_JSON,
+    GENERATION_MAX_BATCH_SIZE,
+    GENERATION_MAX_WAIT_MS,
+    MODEL_BACKEND,
+    MODEL_MAX_NEW_TOKENS
+)
+from app.models.model_loader import get_draft_model, get_engine, get_model, get_tokenizer
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Patterns used on every generated output, compiled once
+_JSON_STRUCTURE_RE = re.compile(r'[{}"\\]')
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+_OBJ_JOIN_RE = re.compile(r'}\s*{')
+_UNQUOTED_KEY_RE = re.compile(r'([{,])\s*([a-zA-Z0-9_]+)\s*:')
+
 def convert_text_answer_to_letter(question_data):
     """
     Convert a text answer to letter format (A/B/C/D) based on the options array.
@@ -25,118 +49,118 @@ def convert_text_answer_to_letter(question_data):
         if isinstance(answer, str) and len(answer) == 1 and answer.upper() in ['A', 'B', 'C', 'D']:
             return question_data
         
-        # Try to find the answer in the options
+        # Check for exact match with one lookup (A for index 0, B for index 1, etc.)
+        letters_by_option = {}
         for i, option in enumerate(options):
-            # Check for exact match
-            if str(option).lower() == str(answer).lower():
-                # Convert to letter (A for index 0, B for index 1, etc.)
-                letter_answer = chr(65 + i)  # 65 is ASCII for 'A'
-                question_data['answer'] = letter_answer
-                return question_data
-            
-            # Check for partial match (e.g., if answer is a longer string that contains the option)
-            if isinstance(answer, str) and isinstance(option, str) and option.lower() in answer.lower():
-                letter_answer = chr(65 + i)
-                question_data['answer'] = letter_answer
-                return question_data
+            letters_by_option.setdefault(str(option).strip().lower(), chr(65 + i))  # 65 is ASCII for 'A'
+        answer_text = str(answer).strip().lower()
+        letter_answer = letters_by_option.get(answer_text)
+        if letter_answer is not None:
+            question_data['answer'] = letter_answer
+            return question_data
         
-        # If we can't find a match but answer is a number, treat it as index
-        if isinstance(answer, (int, str)) and str(answer).isdigit():
-            index = int(str(answer)) - 1  # Convert to 0-based index
+        # If the answer is a number, treat it as a 1-based index
+        if isinstance(answer, (int, str)) and answer_text.isdigit():
+            index = int(answer_text) - 1  # Convert to 0-based index
             if 0 <= index < len(options):
-                letter_answer = chr(65 + index)
-                question_data['answer'] = letter_answer
+                question_data['answer'] = chr(65 + index)
                 return question_data
         
-        logger.warning(f"Could not convert answer '{answer}' to letter format for question: {question_data.get('question', 'unknown')}")
+        # Check for partial match (e.g., if answer is a longer string that contains the option)
+        if isinstance(answer, str):
+            for i, option in enumerate(options):
+                if isinstance(option, str) and option.lower() in answer_text:
+                    question_data['answer'] = chr(65 + i)
+                    return question_data
+        
+        logger.warning("Could not convert answer '%s' to letter format for question: %s", answer, question_data.get('question', 'unknown'))
     
     return question_data
 
+# Keys the model uses for the correct answer; all are normalized to 'answer'
+_ANSWER_KEYS = frozenset({"answer", "correct_answer", "right_answer", "ans", "solution", "correct", "response"})
+
 def normalize_answer_keys(data):
     """
-    Recursively normalize any answer-related key to 'answer' and convert text answers to letter format.
+    Normalize any answer-related key to 'answer' and convert text answers to letter format.
+    Walks the structure iteratively and updates it in place; returns the same object.
     """
-    answer_keys = {"answer", "correct_answer", "right_answer", "ans", "solution", "correct", "response"}
-
-    if isinstance(data, dict):
-        normalized = {}
-        for key, value in data.items():
-            normalized_key = "answer" if key.lower().strip() in answer_keys else key
-            normalized[normalized_key] = normalize_answer_keys(value)
-        
-        # After normalization, check if this is a question dict with options and answer
-        if 'question' in normalized and 'options' in normalized and 'answer' in normalized:
-            normalized = convert_text_answer_to_letter(normalized)
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key in list(node):
+                if key == "answer" or key.lower().strip() not in _ANSWER_KEYS:
+                    continue
+                value = node.pop(key)
+                # An explicit 'answer' key takes precedence over its synonyms
+                node.setdefault("answer", value)
             
-        return normalized
-    elif isinstance(data, list):
-        return [normalize_answer_keys(item) for item in data]
-    else:
-        return data
+            # After normalization, check if this is a question dict with options and answer
+            if 'question' in node and 'options' in node and 'answer' in node:
+                convert_text_answer_to_letter(node)
+            
+            stack.extend(value for value in node.values() if isinstance(value, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(item for item in node if isinstance(item, (dict, list)))
+    return data
+
+def _find_json_span(text):
+    """
+    Find the first balanced {...} object in text in a single pass.
+    Braces inside string literals (including escaped quotes) are ignored.
+    Returns (start, end) slice bounds, or None if no object closes.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_string = False
+    escaped_until = -1
+    # Only braces, quotes and backslashes matter, so jump straight between them
+    for match in _JSON_STRUCTURE_RE.finditer(text, start):
+        i = match.start()
+        if i < escaped_until:
+            continue
+        char = match.group()
+        if in_string:
+            if char == '\\':
+                escaped_until = i + 2  # Skip the escaped character
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    return None
 
 def extract_json_from_text(text):
     """
-    Try multiple approaches to extract valid JSON from text.
+    Extract the first JSON object from text, repairing common syntax issues if needed.
+    Returns the parsed object, so callers don't have to parse the extracted text again.
     """
-    # Method 1: Regex search for JSON object
-    match = re.search(r'\{[\s\S]*\}', text, re.DOTALL)
-    if match:
+    span = _find_json_span(text)
+    if span is not None:
+        json_text = text[span[0]:span[1]]
         try:
-            json_text = match.group(0)
-            json.loads(json_text)  # Validate JSON
-            return json_text
-        except json.JSONDecodeError:
-            logger.warning("Found JSON-like object with regex, but it's not valid JSON")
-    
-    # Method 2: Find first { and last } characters
-    json_start = text.find('{')
-    if json_start != -1:
-        json_end = text.rfind('}')
-        if json_end > json_start:
-            try:
-                json_text = text[json_start:json_end+1]
-                json.loads(json_text)  # Validate JSON
-                return json_text
-            except json.JSONDecodeError:
-                logger.warning("Found JSON-like object with bracket matching, but it's not valid JSON")
-    
-    # Method 3: Balance brackets
-    if json_start != -1:
-        stack = []
-        for i, char in enumerate(text[json_start:]):
-            if char == '{':
-                stack.append('{')
-            elif char == '}':
-                if stack:
-                    stack.pop()
-                    if not stack:  # If stack is empty, we found the matching brace
-                        try:
-                            json_text = text[json_start:json_start+i+1]
-                            json.loads(json_text)  # Validate JSON
-                            return json_text
-                        except json.JSONDecodeError:
-                            logger.warning("Found balanced brackets, but content is not valid JSON")
-                            break  # Try other methods
-    
-    # Method 4: Look for quoted strings and build a minimal structure
-    try:
-        pattern = r'"([^"]*)"'
-        quoted_strings = re.findall(pattern, text)
-        if quoted_strings:
-            # Create a basic quiz structure with the extracted strings
-            questions = []
-            for i in range(0, len(quoted_strings), 2):
-                question = quoted_strings[i]
-                answer = quoted_strings[i+1] if i+1 < len(quoted_strings) else ""
-                questions.append({"question": question, "answer": answer})
-            
-            if questions:
-                return json.dumps({"quiz": {"questions": questions}})
-    except Exception:
-        logger.exception("Failed to extract quoted strings")
+            return orjson.loads(json_text)
+        except orjson.JSONDecodeError:
+            pass
+        # Try to fix common syntax issues before giving up
+        try:
+            return orjson.loads(sanitize_json(json_text))
+        except orjson.JSONDecodeError:
+            logger.warning("Found a JSON-like object, but it's not valid JSON")
+    else:
+        logger.warning("No complete JSON object found in generated text")
     
-    # If all extraction methods fail, return a minimal valid structure
-    return json.dumps({"quiz": {"questions": []}})
+    # If extraction fails, return a minimal valid structure
+    return {"quiz": {"questions": []}}
 
 def sanitize_json(json_text):
     """
@@ -148,91 +172,472 @@ def sanitize_json(json_text):
     sanitized = sanitized.replace('\\t', '\t')
     
     # Fix trailing commas (common error in JSON)
-    sanitized = re.sub(r',\s*([}\]])', r'\1', sanitized)
+    sanitized = _TRAILING_COMMA_RE.sub(r'\1', sanitized)
     
     # Fix missing commas between objects
-    sanitized = re.sub(r'}\s*{', '},{', sanitized)
+    sanitized = _OBJ_JOIN_RE.sub('},{', sanitized)
     
     # Fix missing quotes around property names
-    sanitized = re.sub(r'([{,])\s*([a-zA-Z0-9_]+)\s*:', r'\1"\2":', sanitized)
+    sanitized = _UNQUOTED_KEY_RE.sub(r'\1"\2":', sanitized)
     
     return sanitized
 
-def generate_response(instruction):
+def _fallback_response(instruction, error):
     """
-    Generate a response using the model and return clean JSON with normalized answer keys.
-    Always returns a valid JSON response even if errors occur.
+    Build the minimal valid quiz structure returned when generation or parsing fails.
     """
-    try:
-        model = get_model()
-        tokenizer = get_tokenizer()
+    return {
+        "quiz": {
+            "title": f"Quiz about {instruction}",
+            "questions": []
+        },
+        "error": error
+    }
+
+# The instruction is spliced between these; the space before it is tokenized with the
+# instruction so BPE splits it the same way as the full prompt string
+_PROMPT_PREFIX = "<|im_start|>user\nGenerate a JSON quiz based on this instruction:"
+_PROMPT_SUFFIX = "<|im_end|>"
+
+def _build_prompt(instruction):
+    """
+    Full prompt text for an instruction
+    """
+    return f"{_PROMPT_PREFIX} {instruction}{_PROMPT_SUFFIX}"
+
+# Per-tokenizer caches, guarded by _prompt_ids_lock. Tokenizers are held weakly so the ones
+# passed to generate_response can be freed along with their entries.
+_prompt_ids_lock = threading.Lock()
+_prompt_affix_ids_by_tokenizer = weakref.WeakKeyDictionary()
+_prompt_ids_by_tokenizer = weakref.WeakKeyDictionary()
+_enforcer_data_by_tokenizer = weakref.WeakKeyDictionary()
+
+def _per_tokenizer(cache, tokenizer, build):
+    """
+    Return the cached value for a tokenizer, building it outside the lock on first use
+    """
+    with _prompt_ids_lock:
+        value = cache.get(tokenizer)
+    if value is None:
+        value = build(tokenizer)
+        with _prompt_ids_lock:
+            value = cache.setdefault(tokenizer, value)
+    return value
 
-        input_text = f"<|im_start|>user\nGenerate a JSON quiz based on this instruction: {instruction}<|im_end|>"
-        input_ids = tokenizer(input_text, return_tensors="pt").input_ids.to(model.device)
-        attention_mask = torch.ones_like(input_ids)
+def _tokenize_prompt_affixes(tokenizer):
+    """
+    Tokenize the fixed prompt prefix and suffix
+    """
+    prefix_ids = tokenizer(_PROMPT_PREFIX, add_special_tokens=False).input_ids
+    suffix_ids = tokenizer(_PROMPT_SUFFIX, add_special_tokens=False).input_ids
+    return prefix_ids, suffix_ids
+
+def _prompt_affix_ids(tokenizer):
+    """
+    Prompt prefix and suffix token ids, tokenized once per tokenizer.
+    """
+    return _per_tokenizer(_prompt_affix_ids_by_tokenizer, tokenizer, _tokenize_prompt_affixes)
+
+def _prompt_ids_cache(tokenizer):
+    """
+    Prompt token ids by instruction for one tokenizer; common instructions repeat often.
+    """
+    return _per_tokenizer(_prompt_ids_by_tokenizer, tokenizer, lambda _: LRUCache(maxsize=1024))
+
+def _encode_prompts(tokenizer, instructions):
+    """
+    Tokenize the wrapped prompts for a batch of instructions. Only the instructions
+    themselves are run through the tokenizer, in a single batched call for the ones
+    not cached yet; the fixed prefix and suffix ids are reused.
+    """
+    cache = _prompt_ids_cache(tokenizer)
+    with _prompt_ids_lock:
+        prompt_ids = {instruction: cache.get(instruction) for instruction in instructions}
+    
+    misses = [instruction for instruction, ids in prompt_ids.items() if ids is None]
+    if misses:
+        prefix_ids, suffix_ids = _prompt_affix_ids(tokenizer)
+        batch_ids = tokenizer([f" {instruction}" for instruction in misses], add_special_tokens=False).input_ids
+        for instruction, instruction_ids in zip(misses, batch_ids):
+            prompt_ids[instruction] = tuple(
+                tokenizer.build_inputs_with_special_tokens(prefix_ids + instruction_ids + suffix_ids)
+            )
+        with _prompt_ids_lock:
+            for instruction in misses:
+                cache[instruction] = prompt_ids[instruction]
+    
+    return [prompt_ids[instruction] for instruction in instructions]
+
+class _QuizQuestion(BaseModel):
+    question: str
+    options: List[str]
+    answer: Literal["A", "B", "C", "D"]
+
+class _Quiz(BaseModel):
+    title: Optional[str] = None
+    questions: List[_QuizQuestion]
+
+class _QuizResponse(BaseModel):
+    """
+    Shape of a generated quiz, used to constrain decoding when GENERATION_CONSTRAINED_JSON is on
+    """
+    quiz: _Quiz
+
+def _enforcer_tokenizer_data(tokenizer):
+    """
+    Precompute lm-format-enforcer's view of the vocabulary once per tokenizer.
+    lm-format-enforcer is an optional dependency, so it is imported only here.
+    """
+    from lmformatenforcer.integrations.transformers import build_token_enforcer_tokenizer_data
+    # The data keeps the tokenizer it was built from for decoding; a proxy keeps that
+    # reference from pinning the weakly held key
+    return _per_tokenizer(
+        _enforcer_data_by_tokenizer, tokenizer, lambda tok: build_token_enforcer_tokenizer_data(weakref.proxy(tok))
+    )
+
+def _quiz_prefix_allowed_tokens_fn(tokenizer):
+    """
+    Build a prefix_allowed_tokens_fn that only lets the model emit JSON matching _QuizResponse.
+    A fresh one is built per batch because it remembers every prefix it has seen.
+    """
+    from lmformatenforcer import JsonSchemaParser
+    from lmformatenforcer.integrations.transformers import build_transformers_prefix_allowed_tokens_fn
+    parser = JsonSchemaParser(_QuizResponse.model_json_schema())
+    return build_transformers_prefix_allowed_tokens_fn(_enforcer_tokenizer_data(tokenizer), parser)
+
+class JsonBalancedStop(StoppingCriteria):
+    """
+    Stop generating once every sequence in the batch has closed its top-level JSON object
+    (or ended), instead of running on to max_new_tokens.
+
+    Only the tokens appended since the previous call are decoded (assisted generation can
+    accept several per step), and brace depth is tracked incrementally, ignoring braces
+    inside string literals.
+    """
+
+    def __init__(self, tokenizer, batch_size, prompt_length):
+        self.tokenizer = tokenizer
+        self._seen_length = prompt_length
+        self._depth = [0] * batch_size
+        self._in_string = [False] * batch_size
+        self._escaped = [False] * batch_size
+        self._done = [False] * batch_size
+
+    def _feed(self, row, piece):
+        """
+        Advance one row's scanner over a decoded token; returns True once its object closes
+        """
+        for char in piece:
+            if self._in_string[row]:
+                if self._escaped[row]:
+                    self._escaped[row] = False
+                elif char == '\\':
+                    self._escaped[row] = True
+                elif char == '"':
+                    self._in_string[row] = False
+            elif char == '"':
+                # Strings only count once the object has started
+                self._in_string[row] = self._depth[row] > 0
+            elif char == '{':
+                self._depth[row] += 1
+            elif char == '}' and self._depth[row] > 0:
+                self._depth[row] -= 1
+                if self._depth[row] == 0:
+                    return True
+        return False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_ids = input_ids[:, self._seen_length:].tolist()
+        self._seen_length = input_ids.shape[1]
+        for row, row_ids in enumerate(new_ids):
+            if self._done[row]:
+                continue
+            eos_token_id = self.tokenizer.eos_token_id
+            if eos_token_id in row_ids:
+                # Anything after EOS is padding
+                row_ids = row_ids[:row_ids.index(eos_token_id)]
+                self._done[row] = True
+            if self._feed(row, self.tokenizer.decode(row_ids)):
+                self._done[row] = True
+        return all(self._done)
+
+def _to_device(tensor, device):
+    """
+    Move a CPU tensor to the model device; copies to a GPU go through pinned memory
+    so they don't block the host
+    """
+    if device.type == "cuda":
+        return tensor.pin_memory().to(device, non_blocking=True)
+    return tensor.to(device)
 
+def _generate_texts(instructions, model=None, tokenizer=None):
+    """
+    Run the model once over a batch of instructions and return the decoded output texts.
+    Prompts are left-padded so every sequence in the batch continues from its own last token.
+    """
+    # The speculative-decoding draft is paired with the loaded model only
+    draft_model = get_draft_model() if model is None else None
+    model = model if model is not None else get_model()
+    tokenizer = tokenizer if tokenizer is not None else get_tokenizer()
+
+    encoded = [{"input_ids": list(ids)} for ids in _encode_prompts(tokenizer, instructions)]
+    inputs = tokenizer.pad(encoded, padding=True, return_tensors="pt")
+    input_ids = _to_device(inputs.input_ids, model.device)
+    # A single prompt has no padding, and generate assumes an all-ones mask when none is given
+    attention_mask = _to_device(inputs.attention_mask, model.device) if len(encoded) > 1 else None
+
+    generate_kwargs = {}
+    if draft_model is not None and len(encoded) == 1:
+        # Speculative decoding: the draft proposes tokens that the model verifies in one pass
+        generate_kwargs["assistant_model"] = draft_model
+    if GENERATION_CONSTRAINED_JSON:
+        # Mask out tokens that would break the quiz schema, so the output parses as-is
+        generate_kwargs["prefix_allowed_tokens_fn"] = _quiz_prefix_allowed_tokens_fn(tokenizer)
+
+    # inference_mode skips autograd bookkeeping entirely; nothing here needs gradients
+    with torch.inference_mode():
         outputs = model.generate(
             input_ids,
             attention_mask=attention_mask,
-            max_length=2048,  # Increased max length for more detailed responses
+            max_new_tokens=MODEL_MAX_NEW_TOKENS,  # Budget for the answer only, independent of prompt length
             temperature=0.5,  # Slightly increased temperature for more variety
             top_p=0.9,
             repetition_penalty=1.2,
             do_sample=True,
             num_return_sequences=1,
-            pad_token_id=tokenizer.eos_token_id
+            use_cache=True,
+            pad_token_id=tokenizer.eos_token_id,
+            # Stop as soon as every quiz object is complete instead of waiting for EOS
+            stopping_criteria=StoppingCriteriaList([JsonBalancedStop(tokenizer, len(encoded), input_ids.shape[1])]),
+            **generate_kwargs
         )
+    
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+def _parse_generated_text(output_text, instruction):
+    """
+    Turn raw model output into clean JSON with normalized answer keys.
+    Always returns a valid JSON response even if errors occur.
+    """
+    try:
+        # Extract and parse the JSON in one pass; extraction always yields a parsed object
+        parsed_json = extract_json_from_text(output_text)
+        
+        # Normalize answer keys and convert text answers to letter format
+        normalized_json = normalize_answer_keys(parsed_json)
+        return normalized_json
         
-        output_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    except Exception as e:
+        logger.exception("Error processing generated text: %s", e)
+        # Ensure we always return a valid JSON structure
+        return _fallback_response(instruction, f"Error processing generated text: {str(e)}")
 
-        # Multi-stage processing to ensure we get valid JSON
-        try:
-            # Stage 1: Try to extract JSON
-            json_text = extract_json_from_text(output_text)
-            
-            # Stage 2: Try to parse directly
+def generate_responses(instructions, *, model=None, tokenizer=None):
+    """
+    Generate quizzes for a batch of instructions with a single model.generate call.
+    Returns one result per instruction, in order; errors become fallback responses.
+    """
+    try:
+        output_texts = _generate_texts(instructions, model=model, tokenizer=tokenizer)
+    except Exception as e:
+        logger.exception("Error during generation: %s", e)
+        # Always return a valid JSON instead of raising an exception
+        return [_fallback_response(instruction, f"Error during generation: {str(e)}") for instruction in instructions]
+
+    return _parse_generated_texts(output_texts, instructions)
+
+def _parse_generated_texts(output_texts, instructions):
+    """
+    Parse a batch of output texts, one result per instruction, in order
+    """
+    return [
+        _parse_generated_text(output_text, instruction)
+        for output_text, instruction in zip(output_texts, instructions)
+    ]
+
+def generate_response(instruction: str, *, model=None, tokenizer=None) -> dict:
+    """
+    Generate a response using the model and return clean JSON with normalized answer keys.
+    Always returns a valid JSON response even if errors occur.
+    The loaded model and tokenizer are used unless others are passed in.
+    """
+    return generate_responses([instruction], model=model, tokenizer=tokenizer)[0]
+
+# Model calls run on this single thread, so only one batch uses the GPU at a time while
+# parsing of earlier batches runs in the default threadpool
+_generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+
+class GenerationBatcher:
+    """
+    Collects concurrent generation requests and runs them through the model together.
+
+    The first queued request opens a batch window of `max_delay_ms`; everything that
+    arrives before it closes (up to `max_batch_size`) shares one model.generate call,
+    so the weight reads that dominate decoding are paid once per batch.
+    """
+
+    def __init__(self, max_batch_size=GENERATION_MAX_BATCH_SIZE, max_delay_ms=GENERATION_MAX_WAIT_MS):
+        # Assisted generation only supports one sequence at a time
+        self.max_batch_size = 1 if DRAFT_MODEL_PATH else max(1, max_batch_size)
+        self.max_delay = max_delay_ms / 1000
+        self._queue = None
+        self._worker = None
+        # Parsing tasks still resolving earlier batches; kept so they aren't garbage collected
+        self._pending = set()
+
+    def start(self):
+        """
+        Start the background worker on the running event loop
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Cancel the background worker
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, instruction):
+        """
+        Queue an instruction and wait for its generated quiz
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((instruction, future))
+        return await future
+
+    async def _collect_batch(self):
+        """
+        Wait for the next request, then gather more until the window closes or the batch is full
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
             try:
-                parsed_json = json.loads(json_text)
-                logger.info("Successfully parsed JSON directly")
-            except json.JSONDecodeError:
-                # Stage 3: Sanitize and try again
-                sanitized_json = sanitize_json(json_text)
-                try:
-                    parsed_json = json.loads(sanitized_json)
-                    logger.info("Successfully parsed JSON after sanitization")
-                except json.JSONDecodeError as e:
-                    # If all fails, create a minimal valid JSON with error info
-                    logger.warning(f"Failed to parse JSON even after sanitization: {str(e)}")
-                    parsed_json = {
-                        "quiz": {
-                            "title": f"Quiz about {instruction}",
-                            "questions": []
-                        },
-                        "error": f"Could not generate valid JSON: {str(e)}"
-                    }
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Skip requests whose clients have already gone away
+        return [(instruction, future) for instruction, future in batch if not future.done()]
+
+    async def _run(self):
+        """
+        Worker loop: generate each batch on the generation thread, then hand parsing to the
+        threadpool so the next batch can start generating straight away
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            if not batch:
+                continue
             
-            # Normalize answer keys and convert text answers to letter format
-            normalized_json = normalize_answer_keys(parsed_json)
-            return normalized_json
+            instructions = [instruction for instruction, _ in batch]
+            logger.info("Generating batch of %s quiz request(s)", len(instructions))
+            try:
+                output_texts = await loop.run_in_executor(_generation_executor, _generate_texts, instructions)
+            except Exception as e:
+                logger.exception("Error during batched generation: %s", e)
+                self._resolve(batch, [_fallback_response(instruction, f"Error during generation: {str(e)}") for instruction in instructions])
+                continue
             
+            task = asyncio.create_task(self._parse_and_resolve(batch, output_texts))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _parse_and_resolve(self, batch, output_texts):
+        """
+        Parse a generated batch off the event loop and resolve its futures
+        """
+        instructions = [instruction for instruction, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(None, _parse_generated_texts, output_texts, instructions)
         except Exception as e:
-            logger.exception(f"Error processing generated text: {str(e)}")
-            # Ensure we always return a valid JSON structure
-            return {
-                "quiz": {
-                    "title": f"Quiz about {instruction}",
-                    "questions": []
-                },
-                "error": f"Error processing generated text: {str(e)}"
-            }
+            logger.exception("Error processing generated batch: %s", e)
+            results = [_fallback_response(instruction, f"Error processing generated text: {str(e)}") for instruction in instructions]
+        self._resolve(batch, results)
+
+    @staticmethod
+    def _resolve(batch, results):
+        """
+        Hand each result to the request still waiting for it
+        """
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+# Shared batcher used by the /ask endpoint
+generation_batcher = GenerationBatcher()
+
+async def _generate_text_vllm(instruction):
+    """
+    Generate the output text for one instruction with the vLLM engine.
+    The engine batches concurrent requests itself, so no GenerationBatcher is needed.
+    """
+    from vllm import SamplingParams
+    
+    engine = get_engine()
+    sampling_params = SamplingParams(
+        temperature=0.5,
+        top_p=0.9,
+        repetition_penalty=1.2,
+        max_tokens=MODEL_MAX_NEW_TOKENS
+    )
+    
+    final_output = None
+    async for request_output in engine.generate(_build_prompt(instruction), sampling_params, uuid.uuid4().hex):
+        final_output = request_output
+    return final_output.outputs[0].text
 
+async def _agenerate_uncached(instruction):
+    """
+    Generate a quiz for an instruction with the configured backend
+    """
+    if MODEL_BACKEND != "vllm":
+        return await generation_batcher.submit(instruction)
+    
+    try:
+        output_text = await _generate_text_vllm(instruction)
     except Exception as e:
-        logger.exception(f"Error during generation: {str(e)}")
-        # Always return a valid JSON instead of raising an exception
-        return {
-            "quiz": {
-                "title": f"Quiz about {instruction}",
-                "questions": []
-            },
-            "error": f"Error during generation: {str(e)}"
-        }
+        logger.exception("Error during generation: %s", e)
+        return _fallback_response(instruction, f"Error during generation: {str(e)}")
+    
+    # Parsing is CPU-bound, so keep it off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, _parse_generated_text, output_text, instruction)
+
+# Generated quizzes by normalized instruction, serialized so every hit gets its own copy.
+# Only touched from the event loop, so no lock is needed. Disabled when the size is 0.
+_response_cache = LRUCache(maxsize=GENERATION_CACHE_SIZE) if GENERATION_CACHE_SIZE > 0 else None
+
+async def agenerate_response(instruction):
+    """
+    Generate a quiz for an instruction with the configured backend.
+    Repeated instructions are served from the response cache when it is enabled.
+    Always returns a valid JSON response even if errors occur.
+    """
+    if _response_cache is None:
+        return await _agenerate_uncached(instruction)
+    
+    cache_key = instruction.strip().lower()
+    cached = _response_cache.get(cache_key)
+    if cached is not None:
+        return orjson.loads(cached)
+    
+    response = await _agenerate_uncached(instruction)
+    # Don't pin errors or empty fallback quizzes; the next request should get a real attempt
+    quiz = response.get("quiz") if isinstance(response, dict) else None
+    if "error" not in response and isinstance(quiz, dict) and quiz.get("questions"):
+        _response_cache[cache_key] = orjson.dumps(response)
+    return response
@@ -1,6 +1,26 @@
+import logging
+
 import uvicorn
-from app.main import app
-from app.config import PORT, HOST, DEBUG
+from app.config import PORT, HOST, DEBUG, WORKERS
+
+logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host=HOST, port=PORT, reload=DEBUG)
+    if WORKERS > 1:
+        # There is no shared model server; every worker holds its own copy of the weights
+        logging.basicConfig(level=logging.INFO)
+        logger.warning("Starting %s workers; each one loads its own copy of the model", WORKERS)
+    
+    # The app is passed as an import string so each worker imports it (and loads the model) after
+    # it starts. With uvicorn[standard] installed, the default loop/http settings use uvloop and httptools
+    # where available (uvloop is not supported on Windows, so it isn't forced).
+    uvicorn.run(
+        "app.main:app",
+        host=HOST,
+        port=PORT,
+        reload=DEBUG and WORKERS == 1,
+        workers=WORKERS,
+        log_level="debug" if DEBUG else "info",
+        # Per-request access lines are noise outside development
+        access_log=DEBUG
+    )
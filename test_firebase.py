@@ -1,14 +1,26 @@
+import functools
 import os
-import json
 import logging
+from pathlib import Path
+
+import orjson
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
+
+from app.config import FIREBASE_CREDENTIALS_PATH
+from app.services.firebase_initiator import initialize_firebase
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Fields every service account file must have
+REQUIRED_FIELDS = frozenset({"type", "project_id", "private_key_id", "private_key", "client_email"})
+
+@functools.lru_cache(maxsize=4)
+def _load_creds(path, mtime):
+    """Parse a credentials file; the mtime argument makes edits invalidate the cache"""
+    return orjson.loads(Path(path).read_bytes())
+
 def test_firebase_credentials():
     """Test if Firebase credentials are valid"""
     # Load environment variables
@@ -23,25 +35,23 @@ def test_firebase_credentials():
     logger.info(f"Firebase API Key found: {firebase_api_key[:5]}...")
     
     # Check if credentials file exists
-    creds_path = "creds/klyptik.json"
+    creds_path = FIREBASE_CREDENTIALS_PATH
     if not os.path.exists(creds_path):
         logger.error(f"Firebase credentials file not found at {creds_path}")
         return False
     
     # Check if credentials file is valid JSON
     try:
-        with open(creds_path, 'r') as f:
-            creds_data = json.load(f)
+        creds_data = _load_creds(creds_path, os.path.getmtime(creds_path))
         
         # Check for required fields
-        required_fields = ["type", "project_id", "private_key_id", "private_key", "client_email"]
-        for field in required_fields:
-            if field not in creds_data:
-                logger.error(f"Firebase credentials file is missing required field: {field}")
-                return False
+        missing_fields = REQUIRED_FIELDS - creds_data.keys()
+        if missing_fields:
+            logger.error(f"Firebase credentials file is missing required fields: {', '.join(sorted(missing_fields))}")
+            return False
         
         logger.info(f"Firebase credentials file is valid JSON with required fields")
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error(f"Firebase credentials file is not valid JSON")
         return False
     except Exception as e:
@@ -50,12 +60,8 @@ def test_firebase_credentials():
     
     # Try to initialize Firebase
     try:
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(creds_path)
-            firebase_admin.initialize_app(cred)
-        
-        # Try to access Firestore
-        db = firestore.client()
+        # Use the same initialization path as the app
+        db = initialize_firebase()
         # Try a simple operation
         collections = [col.id for col in db.collections()]
         logger.info(f"Successfully connected to Firestore. Collections: {collections}")
@@ -1,13 +1,17 @@
 import os
 import requests
-import json
 import logging
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Reuse connections (and their TLS handshakes) across checks
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
 def test_firebase_api_key():
     """Test if Firebase API key is valid"""
     # Load environment variables
@@ -32,7 +36,7 @@ def test_firebase_api_key():
             "providerId": "password"
         }
         
-        response = requests.post(test_url, json=payload)
+        response = _SESSION.post(test_url, json=payload, timeout=5)
         
         # Check if the response is valid
         if response.status_code == 400: